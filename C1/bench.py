@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+
+import zadanie
+import zadanie2
+from constants import Colors
+
+
+def create_scene(figure_count, size=100, spacing=150):
+    """Create a square grid of cubes laid out on the XZ plane."""
+    columns = int(np.ceil(np.sqrt(figure_count)))
+    cube = np.array([
+        [0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0],
+        [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1],
+    ]) * size
+
+    points = {}
+    for i in range(figure_count):
+        row, column = divmod(i, columns)
+        offset = np.array([(column - columns / 2) * spacing, 0, -row * spacing])
+        points[f"points_{i + 1}"] = (cube + offset).tolist()
+
+    return points
+
+
+def camera_path(frame, frames):
+    """Deterministic camera position and rotation for a frame of the scripted flight."""
+    t = frame / max(frames - 1, 1)
+    position = (200 * np.sin(2 * np.pi * t), 50 + 100 * t, 750 - 450 * t)
+    rotation = (0.2 * np.sin(2 * np.pi * t), 0.1 * t, 0.0)
+    return position, rotation
+
+
+def summarize(timings):
+    timings = np.asarray(timings) * 1000
+    return {
+        "mean_ms": float(np.mean(timings)),
+        "median_ms": float(np.median(timings)),
+        "p95_ms": float(np.percentile(timings, 95)),
+        "max_ms": float(np.max(timings)),
+        "total_ms": float(np.sum(timings)),
+    }
+
+
+def run_stages(stages, frames):
+    """Run the stage callables once per frame and time each of them."""
+    timings = {name: [] for name, _ in stages}
+    frame_timings = []
+
+    for frame in range(frames):
+        result = frame
+        frame_start = time.perf_counter()
+        for name, stage in stages:
+            start = time.perf_counter()
+            result = stage(result)
+            timings[name].append(time.perf_counter() - start)
+        frame_timings.append(time.perf_counter() - frame_start)
+
+    return {
+        "stages": {name: summarize(stage_timings) for name, stage_timings in timings.items()},
+        "frame": summarize(frame_timings),
+    }
+
+
+def bench_zadanie(points_file, frames):
+    simulation = zadanie.CameraSimulation(points_file=points_file)
+
+    def handle_input(frame):
+        simulation.camera.position[:], simulation.camera.rotation[:] = camera_path(frame, frames)
+        simulation.handle_input()
+
+    def draw(transformed_figures):
+        simulation.screen.fill(Colors.BLACK)
+        simulation.draw_figures(transformed_figures)
+
+    stages = [
+        ("input", handle_input),
+        ("transform", lambda _: simulation.transform_figures()),
+        ("draw", draw),
+        ("flip", lambda _: pygame.display.flip()),
+    ]
+    result = run_stages(stages, frames)
+    result["figures"] = len(simulation.buffers)
+    return result
+
+
+def bench_zadanie2(points_file, frames, partition_factor):
+    simulation = zadanie2.CameraSimulation(partition_factor=partition_factor, points_file=points_file)
+
+    def handle_input(frame):
+        simulation.camera.position[:], simulation.camera.rotation[:] = camera_path(frame, frames)
+        simulation.handle_input()
+
+    def draw(projected_walls):
+        simulation.screen.fill(Colors.BLACK)
+        simulation.fill_walls(projected_walls)
+
+    stages = [
+        ("input", handle_input),
+        ("cull", lambda _: simulation.visible_walls()),
+        ("depth_sort", simulation.sort_walls),
+        ("transform", lambda sorted_walls: simulation.transform_walls(*sorted_walls)),
+        ("draw", draw),
+        ("flip", lambda _: pygame.display.flip()),
+    ]
+    result = run_stages(stages, frames)
+    result["figures"] = len(simulation.buffers)
+    result["walls"] = len(simulation.partitioned_walls)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the camera simulations without a display.")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--partition-factors", type=int, nargs="+", default=[1, 2, 3, 4])
+    parser.add_argument("--scene-sizes", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--simulations", nargs="+", choices=["zadanie", "zadanie2"], default=["zadanie", "zadanie2"])
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for scene_size in args.scene_sizes:
+            points_file = os.path.join(directory, f"scene_{scene_size}.txt")
+            with open(points_file, "w") as file:
+                json.dump(create_scene(scene_size), file)
+
+            if "zadanie" in args.simulations:
+                result = bench_zadanie(points_file, args.frames)
+                results.append({"simulation": "zadanie", "scene_size": scene_size, **result})
+
+            if "zadanie2" in args.simulations:
+                for partition_factor in args.partition_factors:
+                    result = bench_zadanie2(points_file, args.frames, partition_factor)
+                    results.append({
+                        "simulation": "zadanie2",
+                        "scene_size": scene_size,
+                        "partition_factor": partition_factor,
+                        **result,
+                    })
+
+    report = {
+        "frames": args.frames,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pygame": pygame.version.ver,
+        "video_driver": os.environ["SDL_VIDEODRIVER"],
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
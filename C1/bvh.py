@@ -0,0 +1,115 @@
+import numpy as np
+
+
+class FigureBVH:
+    """Bounding volume hierarchy over the bounding boxes of figures.
+
+    Nodes live in arrays: node_mins and node_maxs hold the (N, 3) boxes,
+    children the (N, 2) child nodes, parents the parent of every node and
+    figures the figure of every leaf (-1 for inner nodes). Each leaf holds one
+    figure; inner nodes split theirs at the median centre along the longest
+    axis. Node 0 is the root.
+    """
+
+    def __init__(self, mins, maxs):
+        mins = np.asarray(mins, dtype=float).reshape(-1, 3)
+        maxs = np.asarray(maxs, dtype=float).reshape(-1, 3)
+        figure_count = len(mins)
+        node_count = max(2 * figure_count - 1, 0)
+
+        self.node_mins = np.empty((node_count, 3))
+        self.node_maxs = np.empty((node_count, 3))
+        self.children = np.full((node_count, 2), -1)
+        self.parents = np.full(node_count, -1)
+        self.figures = np.full(node_count, -1)
+        self.leaves = np.empty(figure_count, dtype=int)
+        if figure_count:
+            self._build(mins, maxs)
+
+    def __len__(self):
+        return len(self.leaves)
+
+    def _build(self, mins, maxs):
+        centers = (mins + maxs) / 2
+        next_node = 1
+        stack = [(0, np.arange(len(mins)))]
+        while stack:
+            node, figures = stack.pop()
+            self.node_mins[node] = mins[figures].min(axis=0)
+            self.node_maxs[node] = maxs[figures].max(axis=0)
+            if len(figures) == 1:
+                self.figures[node] = figures[0]
+                self.leaves[figures[0]] = node
+                continue
+
+            axis = np.argmax(np.ptp(centers[figures], axis=0))
+            figures = figures[np.argsort(centers[figures, axis], kind="stable")]
+            half = len(figures) // 2
+            left, right = next_node, next_node + 1
+            next_node += 2
+            self.children[node] = left, right
+            self.parents[[left, right]] = node
+            stack.append((left, figures[:half]))
+            stack.append((right, figures[half:]))
+
+    def refit(self, figures, mins, maxs):
+        """Update the boxes of the given figures and of their ancestors only."""
+        nodes = self.leaves[np.asarray(figures, dtype=int)]
+        self.node_mins[nodes] = mins
+        self.node_maxs[nodes] = maxs
+
+        # One level at a time; a node's last update always follows its children's
+        nodes = np.unique(self.parents[nodes])
+        nodes = nodes[nodes >= 0]
+        while len(nodes):
+            children = self.children[nodes]
+            self.node_mins[nodes] = np.minimum(self.node_mins[children[:, 0]], self.node_mins[children[:, 1]])
+            self.node_maxs[nodes] = np.maximum(self.node_maxs[children[:, 0]], self.node_maxs[children[:, 1]])
+            nodes = np.unique(self.parents[nodes])
+            nodes = nodes[nodes >= 0]
+
+    def back_to_front(self, camera):
+        """Figures inside the view frustum, from the farthest to the nearest.
+
+        Subtrees whose box is outside the frustum are skipped whole. At every
+        inner node the child whose box centre is farther from the camera is
+        visited first.
+        """
+        order = np.zeros(min(len(self.figures), 1), dtype=int)
+        while len(order):
+            order = order[camera.boxes_visible(self.node_mins[order], self.node_maxs[order])]
+            inner = self.figures[order] < 0
+            if not inner.any():
+                break
+
+            children = self.children[order[inner]]
+            centers = (self.node_mins[children] + self.node_maxs[children]) / 2
+            distances = np.linalg.norm(centers - camera.position, axis=2)
+            swap = distances[:, 0] < distances[:, 1]
+            children[swap] = children[swap, ::-1]
+
+            # Inner nodes are replaced by their two children in place
+            counts = np.where(inner, 2, 1)
+            starts = np.cumsum(counts) - counts
+            expanded = np.empty(counts.sum(), dtype=int)
+            expanded[starts[~inner]] = order[~inner]
+            expanded[starts[inner]] = children[:, 0]
+            expanded[starts[inner] + 1] = children[:, 1]
+            order = expanded
+
+        return self.figures[order]
+
+    def visible(self, camera):
+        """(F,) mask of the figures whose box is not wholly outside the view frustum.
+
+        Walks the hierarchy like back_to_front but leaves nodes unordered.
+        """
+        visible = np.zeros(len(self), dtype=bool)
+        nodes = np.zeros(min(len(self.figures), 1), dtype=int)
+        while len(nodes):
+            nodes = nodes[camera.boxes_visible(self.node_mins[nodes], self.node_maxs[nodes])]
+            figures = self.figures[nodes]
+            visible[figures[figures >= 0]] = True
+            nodes = self.children[nodes[figures < 0]].reshape(-1)
+
+        return visible
@@ -5,6 +5,7 @@ class Colors:
     BLUE = (0, 0, 255)
     PURPLE = (255, 0, 255)
     BLACK = (0, 0, 0)
+    WALLS = (RED, GREEN, BLUE, PURPLE)
 
 
 class Display:
@@ -0,0 +1,18 @@
+import argparse
+
+from utils import read_points, write_scene
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a JSON points file into the binary scene format.")
+    parser.add_argument("source", help="JSON points file, e.g. points.txt")
+    parser.add_argument("destination", help="binary scene file to write, e.g. points.scene")
+    args = parser.parse_args()
+
+    points = read_points(args.source)
+    write_scene(args.destination, points)
+    print(f"Wrote {len(points)} figures to {args.destination}")
+
+
+if __name__ == "__main__":
+    main()
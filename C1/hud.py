@@ -0,0 +1,28 @@
+class TextCache:
+    """Rendered text keyed by its string, so unchanged HUD lines are not rendered again.
+
+    convert, when given, turns each rendered surface into whatever the caller
+    draws with (e.g. raw pixels for OpenGL) and its result is cached instead.
+    The oldest entries are dropped past max_entries.
+    """
+
+    def __init__(self, font, color, antialias=True, convert=None, max_entries=256):
+        self.font = font
+        self.color = color
+        self.antialias = antialias
+        self.convert = convert
+        self.max_entries = max_entries
+        self._rendered = {}
+
+    def render(self, text):
+        rendered = self._rendered.get(text)
+        if rendered is None:
+            if len(self._rendered) >= self.max_entries:
+                del self._rendered[next(iter(self._rendered))]
+
+            rendered = self.font.render(text, self.antialias, self.color)
+            if self.convert is not None:
+                rendered = self.convert(rendered)
+            self._rendered[text] = rendered
+
+        return rendered
@@ -0,0 +1,216 @@
+import numpy as np
+
+from utils import read_points, map_scene, is_scene_file
+from constants import edges as cube_edges, walls as cube_walls
+
+
+def split_faces(faces):
+    """(P, 4) quads from polygons of any size.
+
+    Triangles repeat their last corner and larger polygons are split into a
+    fan of quads around their first corner, as clipping does for walls.
+    """
+    quads = []
+    for face in faces:
+        face = list(face)
+        if len(face) < 3:
+            raise ValueError(f"face {face} has fewer than 3 corners")
+
+        k = 1
+        while k + 2 < len(face):
+            quads.append([face[0], face[k], face[k + 1], face[k + 2]])
+            k += 2
+        if k + 1 == len(face) - 1:
+            quads.append([face[0], face[k], face[k + 1], face[k + 1]])
+
+    return np.array(quads, dtype=int).reshape(-1, 4)
+
+
+def face_edges(faces):
+    """(E, 2) unique undirected edges around the given polygons."""
+    pairs = [
+        (face[i], face[(i + 1) % len(face)])
+        for face in faces
+        for i in range(len(face))
+    ]
+    if not pairs:
+        return np.zeros((0, 2), dtype=int)
+
+    return np.unique(np.sort(np.array(pairs, dtype=int), axis=1), axis=0)
+
+
+class Mesh:
+    """Polygon mesh sharing its vertices between faces.
+
+    vertices holds the (V, 3) points, polygons the (P, 4) vertex indices of
+    every face and edges the (E, 2) vertex indices of the outline. Faces that
+    are not quads are split with split_faces; edges default to the outline of
+    the original faces. wound tells whether the faces are wound
+    counter-clockwise seen from the front, as OBJ faces are; the faces of
+    other meshes are turned away from the mesh centre, which needs a convex
+    mesh.
+    """
+
+    def __init__(self, vertices, faces, edges=None, wound=True):
+        self.vertices = np.asarray(vertices, dtype=float).reshape(-1, 3)
+        self.polygons = split_faces(faces)
+        self.wound = wound
+        if edges is None:
+            self.edges = face_edges(faces)
+        else:
+            self.edges = np.asarray(edges, dtype=int).reshape(-1, 2)
+
+
+class MeshBuffers:
+    """Meshes of a scene packed into scene-wide struct-of-arrays buffers.
+
+    vertices, polygons and edges concatenate those of every mesh, with
+    polygons and edges keeping mesh-local vertex indices; the mesh i owns
+    rows vertex_offsets[i]:vertex_offsets[i + 1] and likewise for the others.
+    scene_polygons and scene_edges hold every polygon and edge with
+    scene-wide vertex indices, polygon_figure_ids and edge_figure_ids their
+    mesh and polygon_wound the wound flag of the mesh of every polygon.
+    vertices keep the dtype they are given in.
+    """
+
+    def __init__(self, meshes):
+        names = list(meshes)
+        meshes = list(meshes.values())
+        self._pack(
+            names,
+            np.concatenate([mesh.vertices for mesh in meshes] + [np.zeros((0, 3))]),
+            np.concatenate([mesh.polygons for mesh in meshes] + [np.zeros((0, 4), dtype=int)]),
+            np.concatenate([mesh.edges for mesh in meshes] + [np.zeros((0, 2), dtype=int)]),
+            [len(mesh.vertices) for mesh in meshes],
+            [len(mesh.polygons) for mesh in meshes],
+            [len(mesh.edges) for mesh in meshes],
+            [mesh.wound for mesh in meshes],
+        )
+
+    @classmethod
+    def cubes(cls, names, points):
+        """Buffers of figures given as the 8 corners of a cube each, one figure after another in points.
+
+        points is packed as is, without going through a Mesh per figure, so a
+        memory-mapped float32 block stays mapped and is read only where used.
+        """
+        points = np.asarray(points).reshape(-1, 3)
+        count = len(names)
+        if len(points) != 8 * count:
+            raise ValueError(f"expected 8 corners for each of {count} figures, got {len(points)} points")
+
+        buffers = cls.__new__(cls)
+        buffers._pack(
+            list(names),
+            points,
+            np.tile(split_faces(cube_walls), (count, 1)),
+            np.tile(np.asarray(cube_edges, dtype=int), (count, 1)),
+            np.full(count, 8),
+            np.full(count, len(cube_walls)),
+            np.full(count, len(cube_edges)),
+            np.zeros(count, dtype=bool),
+        )
+        return buffers
+
+    def _pack(self, names, vertices, polygons, edges, vertex_counts, polygon_counts, edge_counts, wound):
+        self.names = names
+        self.vertices = vertices
+        self.polygons = polygons
+        self.edges = edges
+        self.vertex_offsets = _offsets(vertex_counts)
+        self.polygon_offsets = _offsets(polygon_counts)
+        self.edge_offsets = _offsets(edge_counts)
+
+        self.polygon_figure_ids = np.repeat(np.arange(len(names)), np.diff(self.polygon_offsets))
+        self.scene_polygons = self.polygons + self.vertex_offsets[self.polygon_figure_ids, None]
+        self.polygon_wound = np.asarray(wound, dtype=bool)[self.polygon_figure_ids]
+        self.edge_figure_ids = np.repeat(np.arange(len(names)), np.diff(self.edge_offsets))
+        self.scene_edges = self.edges + self.vertex_offsets[self.edge_figure_ids, None]
+
+        if names:
+            self.figure_mins = np.minimum.reduceat(self.vertices, self.vertex_offsets[:-1])
+            self.figure_maxs = np.maximum.reduceat(self.vertices, self.vertex_offsets[:-1])
+            self.figure_centers = (np.add.reduceat(self.vertices, self.vertex_offsets[:-1], dtype=float)
+                                   / np.diff(self.vertex_offsets)[:, None])
+        else:
+            self.figure_mins = self.figure_maxs = self.figure_centers = np.zeros((0, 3))
+
+    def __len__(self):
+        return len(self.names)
+
+
+def _offsets(counts):
+    return np.concatenate([[0], np.cumsum(counts, dtype=int)]).astype(int)
+
+
+def load_obj(filename):
+    """Read the objects of a Wavefront OBJ file as meshes keyed by object name.
+
+    Only vertex positions, faces and line elements are used; texture and
+    normal indices are ignored. Faces before the first `o` or `g` statement
+    belong to an object named after the file.
+    """
+    vertices = []
+    objects = {}
+    name = filename
+    faces, lines = objects.setdefault(name, ([], []))
+
+    def vertex_index(token):
+        index = int(token.split("/")[0])
+        return index - 1 if index > 0 else len(vertices) + index
+
+    with open(filename, "r") as file:
+        for line in file:
+            values = line.split("#", 1)[0].split()
+            if not values:
+                continue
+
+            if values[0] == "v":
+                vertices.append([float(value) for value in values[1:4]])
+            elif values[0] in ("o", "g"):
+                name = " ".join(values[1:]) or name
+                faces, lines = objects.setdefault(name, ([], []))
+            elif values[0] == "f":
+                faces.append([vertex_index(token) for token in values[1:]])
+            elif values[0] == "l":
+                indices = [vertex_index(token) for token in values[1:]]
+                lines.extend(zip(indices, indices[1:]))
+
+    vertices = np.array(vertices, dtype=float).reshape(-1, 3)
+    meshes = {}
+    for name, (faces, lines) in objects.items():
+        if not faces and not lines:
+            continue
+
+        # Keep only the vertices the object uses, renumbered from zero
+        used = sorted({index for face in faces for index in face} | {index for line in lines for index in line})
+        renumber = {index: i for i, index in enumerate(used)}
+        object_faces = [[renumber[index] for index in face] for face in faces]
+        edges = face_edges(object_faces)
+        if lines:
+            object_lines = np.array([[renumber[a], renumber[b]] for a, b in lines], dtype=int)
+            edges = np.unique(np.sort(np.concatenate([edges, object_lines]), axis=1), axis=0)
+        meshes[name] = Mesh(vertices[used], object_faces, edges)
+
+    return meshes
+
+
+def load_buffers(filename):
+    """MeshBuffers of every figure in an OBJ file, or in a points file of cube corners.
+
+    Binary scenes are packed straight from their memory-mapped block.
+    """
+    if filename.lower().endswith(".obj"):
+        return MeshBuffers(load_obj(filename))
+
+    if is_scene_file(filename):
+        names, counts, points = map_scene(filename)
+    else:
+        figures = read_points(filename)
+        names = list(figures)
+        counts = [len(figure) for figure in figures.values()]
+        points = np.concatenate([np.reshape(figure, (-1, 3)) for figure in figures.values()] + [np.zeros((0, 3))])
+
+    if any(count != 8 for count in counts):
+        raise ValueError(f"{filename}: every figure needs the 8 corners of a cube")
+    return MeshBuffers.cubes(names, points)
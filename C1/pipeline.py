@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+class FramePipeline:
+    """Prepares frames on a worker thread one frame ahead of the caller.
+
+    next_frame starts preparing the given frame and returns the result started
+    by the previous call, so preparing a frame overlaps drawing the one before
+    it. Every frame is tagged with a key describing the settings it was
+    prepared for; when the key changes the older result is dropped and the
+    caller waits for the new one, so results are never more than one frame
+    behind and never belong to other settings.
+    """
+
+    def __init__(self, prepare):
+        self.prepare = prepare
+        self._executor = None
+        self._pending = None
+
+    def next_frame(self, frame, key):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="frame-pipeline")
+
+        previous = self._pending
+        self._pending = key, self._executor.submit(self.prepare, frame)
+        if previous is not None and previous[0] == key:
+            return previous[1].result()
+        return self._pending[1].result()
+
+    def drain(self):
+        """Wait for the frame in flight and drop it, before the caller prepares frames itself again."""
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            pending[1].exception()
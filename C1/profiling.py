@@ -0,0 +1,120 @@
+import json
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class FrameProfiler:
+    """Switchable per-stage frame timers with rolling statistics.
+
+    Keeps the last `window` timings of every stage for the overlay and the
+    events of the last `trace_frames` frames for a Chrome trace dump.
+    """
+
+    def __init__(self, enabled=False, window=240, trace_frames=300):
+        self.enabled = enabled
+        self.window = window
+        self.timings = {}
+        self.counters = {}
+        self.trace = deque(maxlen=trace_frames)
+        self._frame_events = []
+        self._origin = time.perf_counter()
+
+    def stage(self, name):
+        """Context manager timing one stage of the current frame."""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def record(self, name, start, end):
+        timings = self.timings.get(name)
+        if timings is None:
+            timings = self.timings[name] = deque(maxlen=self.window)
+        timings.append(end - start)
+        self._frame_events.append((name, start, end))
+
+    def count(self, name, value):
+        if self.enabled:
+            self.counters[name] = value
+
+    def end_frame(self):
+        if self.enabled:
+            self.trace.append((self._frame_events, dict(self.counters)))
+        self._frame_events = []
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.timings.clear()
+        self.counters.clear()
+        self.trace.clear()
+        self._frame_events = []
+
+    def stats(self, name):
+        """Mean, p95 and p99 of a stage in milliseconds."""
+        timings = np.fromiter(self.timings[name], dtype=float) * 1000
+        mean = float(np.mean(timings))
+        p95, p99 = np.percentile(timings, [95, 99])
+        return mean, float(p95), float(p99)
+
+    def summary_lines(self):
+        lines = []
+        for name in self.timings:
+            mean, p95, p99 = self.stats(name)
+            lines.append(f"{name}: {mean:.2f} ms  p95 {p95:.2f}  p99 {p99:.2f}")
+        for name, value in self.counters.items():
+            lines.append(f"{name}: {value}")
+        return lines
+
+    def dump_trace(self, filename):
+        """Write the recorded frames as a Chrome trace / Perfetto JSON file."""
+        events = []
+        pid = os.getpid()
+        for frame_events, counters in self.trace:
+            for name, start, end in frame_events:
+                events.append({
+                    "name": name,
+                    "ph": "X",
+                    "ts": (start - self._origin) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": pid,
+                    "tid": 0,
+                })
+            if frame_events and counters:
+                events.append({
+                    "name": "counters",
+                    "ph": "C",
+                    "ts": (frame_events[0][1] - self._origin) * 1e6,
+                    "pid": pid,
+                    "args": counters,
+                })
+
+        with open(filename, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
@@ -0,0 +1,101 @@
+import numpy as np
+import pygame
+
+# Corners of the two triangles every quad is split into
+_QUAD_TRIANGLES = np.array([[0, 1, 2], [0, 2, 3]])
+
+
+class ZBufferRenderer:
+    """Software rasterizer drawing flat-shaded quads into NumPy depth and color buffers.
+
+    Buffers use the (width, height) layout of pygame.surfarray. Depth holds the
+    interpolated inverse camera-space distance, so larger values are nearer and
+    a cleared buffer is infinitely far away. Triangles are rasterized as
+    per-row spans, in batches covering at most batch_pixels bounding-box
+    pixels.
+    """
+
+    def __init__(self, width, height, batch_pixels=1 << 21):
+        self.width = width
+        self.height = height
+        self.batch_pixels = batch_pixels
+        self.depth = np.zeros((width, height))
+        self.color = np.zeros((width, height, 3), dtype=np.uint8)
+
+    def clear(self, color):
+        self.depth.fill(0)
+        self.color[:] = color
+
+    def draw_quads(self, screen_walls, view_depths, colors):
+        """Rasterize (K, 4, 2) screen quads with (K, 4) corner distances and (K, 3) colors."""
+        triangles = screen_walls[:, _QUAD_TRIANGLES].reshape(-1, 3, 2)
+        inverse_depths = (1 / view_depths)[:, _QUAD_TRIANGLES].reshape(-1, 3)
+        colors = np.repeat(np.asarray(colors, dtype=np.uint8), 2, axis=0)
+
+        # Edge functions w_i(x, y) = a_i * x + b_i * y + c_i, normalized to barycentric weights
+        x, y = triangles[:, :, 0], triangles[:, :, 1]
+        x_next, y_next = np.roll(x, -1, axis=1), np.roll(y, -1, axis=1)
+        x_prev, y_prev = np.roll(x, 1, axis=1), np.roll(y, 1, axis=1)
+        area = (x_next[:, 0] - x[:, 0]) * (y_prev[:, 0] - y[:, 0]) - (y_next[:, 0] - y[:, 0]) * (x_prev[:, 0] - x[:, 0])
+
+        mins = np.maximum(np.floor(triangles.min(axis=1)).astype(int), 0)
+        maxs = np.minimum(np.ceil(triangles.max(axis=1)).astype(int), (self.width - 1, self.height - 1))
+        drawn = (area != 0) & (mins <= maxs).all(axis=1)
+
+        area = area[drawn, None]
+        edge_a = (y_next - y_prev)[drawn] / area
+        edge_b = (x_prev - x_next)[drawn] / area
+        edge_c = (x_next * y_prev - y_next * x_prev)[drawn] / area
+        inverse_depths = inverse_depths[drawn]
+        depth_coefficients = np.stack([
+            (edge_a * inverse_depths).sum(axis=1),
+            (edge_b * inverse_depths).sum(axis=1),
+            (edge_c * inverse_depths).sum(axis=1),
+        ], axis=1)
+
+        mins, maxs, colors = mins[drawn], maxs[drawn], colors[drawn]
+        pixel_counts = np.prod(maxs - mins + 1, axis=1)
+        batch_ids = np.cumsum(pixel_counts) // self.batch_pixels
+        for batch in np.unique(batch_ids):
+            batch_triangles = np.flatnonzero(batch_ids == batch)
+            self._draw_batch(edge_a[batch_triangles], edge_b[batch_triangles], edge_c[batch_triangles],
+                             depth_coefficients[batch_triangles], colors[batch_triangles],
+                             mins[batch_triangles], maxs[batch_triangles])
+
+    def _draw_batch(self, edge_a, edge_b, edge_c, depth_coefficients, colors, mins, maxs):
+        # One span per bounding-box row of every triangle
+        row_counts = maxs[:, 1] - mins[:, 1] + 1
+        row_triangles = np.repeat(np.arange(len(mins)), row_counts)
+        y = mins[row_triangles, 1] + np.arange(len(row_triangles)) - np.repeat(np.cumsum(row_counts) - row_counts,
+                                                                               row_counts)
+        center_y = y + 0.5
+
+        # Pixel centres x + 0.5 where all three edge functions are non-negative
+        a = edge_a[row_triangles]
+        k = edge_b[row_triangles] * center_y[:, None] + edge_c[row_triangles]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            bound = -k / a - 0.5
+        lower = np.where(a > 0, np.ceil(bound), -np.inf)
+        upper = np.where(a < 0, np.floor(bound), np.inf)
+        empty = ((a == 0) & (k < 0)).any(axis=1)
+        start = np.maximum(lower.max(axis=1), mins[row_triangles, 0])
+        end = np.minimum(upper.min(axis=1), maxs[row_triangles, 0])
+        span_lengths = np.where(empty, 0, np.maximum(end - start + 1, 0)).astype(int)
+
+        # Pixels of every span and their interpolated inverse depths
+        pixel_rows = np.repeat(np.arange(len(row_triangles)), span_lengths)
+        x = start.astype(int)[pixel_rows] + np.arange(len(pixel_rows)) - np.repeat(
+            np.cumsum(span_lengths) - span_lengths, span_lengths)
+        pixel_triangles = row_triangles[pixel_rows]
+        row_depths = depth_coefficients[row_triangles, 1] * center_y + depth_coefficients[row_triangles, 2]
+        depth = depth_coefficients[pixel_triangles, 0] * (x + 0.5) + row_depths[pixel_rows]
+
+        # Depth test: keep the nearest candidate of every pixel, unless the buffer is nearer
+        pixels = x * self.height + y[pixel_rows]
+        depth_buffer = self.depth.reshape(-1)
+        np.maximum.at(depth_buffer, pixels, depth)
+        nearest = depth == depth_buffer[pixels]
+        self.color.reshape(-1, 3)[pixels[nearest]] = colors[pixel_triangles[nearest]]
+
+    def present(self, surface):
+        pygame.surfarray.blit_array(surface, self.color)
@@ -0,0 +1,294 @@
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from utils import clip_polygon_near
+from bvh import FigureBVH
+
+
+# Walls ready to draw: wall indices and centroid depths, (K, 4, 2) screen
+# corners, the (K, 4) camera-space distance of every corner and the number
+# of vertices transformed to camera space for them.
+ProjectedWalls = namedtuple("ProjectedWalls", ["order", "depths", "screen_walls", "view_depths",
+                                               "transformed_vertices"])
+
+
+class WallStore:
+    """Partitioned walls of all figures kept in contiguous arrays.
+
+    vertices holds the (V, 3) points shared between walls, quads the (M, 4)
+    vertex indices of every wall, centroids the (M, 3) wall centres and
+    figure_ids the (M,) index of the figure each wall belongs to. wall_ids maps
+    every partitioned wall to the source wall it was cut from, whose outward
+    normal and centre are kept in wall_normals and wall_centers. bvh
+    optionally gives a hierarchy already built over the figures' boxes; it
+    may also cover figures without walls.
+    """
+
+    def __init__(self, vertices, quads, figure_ids, wall_ids, wall_normals, wall_centers, bvh=None):
+        self.vertices = np.asarray(vertices, dtype=float).reshape(-1, 3)
+        self.quads = np.asarray(quads, dtype=int).reshape(-1, 4)
+        self.figure_ids = np.asarray(figure_ids, dtype=int).reshape(-1)
+        self.wall_ids = np.asarray(wall_ids, dtype=int).reshape(-1)
+        self.wall_normals = np.asarray(wall_normals, dtype=float).reshape(-1, 3)
+        self.wall_centers = np.asarray(wall_centers, dtype=float).reshape(-1, 3)
+        corners = [self.vertices[self.quads[:, corner]] for corner in range(4)]
+        self.centroids = sum(corners) / 4
+
+        # Vertices may be shared between walls, so the boxes are gathered from the quads
+        wall_count = len(self.wall_normals)
+        quad_mins = np.minimum(np.minimum(corners[0], corners[1]), np.minimum(corners[2], corners[3]))
+        quad_maxs = np.maximum(np.maximum(corners[0], corners[1]), np.maximum(corners[2], corners[3]))
+        self.wall_mins = _reduce_groups(np.minimum, quad_mins, self.wall_ids, wall_count, np.inf)
+        self.wall_maxs = _reduce_groups(np.maximum, quad_maxs, self.wall_ids, wall_count, -np.inf)
+
+        self.wall_figure_ids = np.empty(wall_count, dtype=int)
+        self.wall_figure_ids[self.wall_ids] = self.figure_ids
+        if bvh is not None:
+            figure_count = len(bvh)
+        else:
+            figure_count = self.wall_figure_ids.max() + 1 if wall_count else 0
+        self.figure_mins = _reduce_groups(np.minimum, self.wall_mins, self.wall_figure_ids, figure_count, np.inf)
+        self.figure_maxs = _reduce_groups(np.maximum, self.wall_maxs, self.wall_figure_ids, figure_count, -np.inf)
+        self.bvh = bvh if bvh is not None else FigureBVH(self.figure_mins, self.figure_maxs)
+
+        # Order returned by the last depth_order call and the inputs it was made for
+        self._order_key = None
+        self._order = None
+        # Last back-to-front walk of the hierarchy and the camera state it was made for
+        self._walk_key = None
+        self._walk = None
+
+    def __len__(self):
+        return len(self.quads)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the arrays of the store, with room for the draw order depth_order keeps."""
+        arrays = [value for value in vars(self).values() if isinstance(value, np.ndarray)]
+        return sum(array.nbytes for array in arrays) + len(self) * 16
+
+    def facing(self, camera_position):
+        """(W,) mask of the source walls whose front side faces the camera."""
+        to_camera = camera_position - self.wall_centers
+        return np.einsum("ij,ij->i", self.wall_normals, to_camera) > 0
+
+    def in_frustum(self, camera, ordered=False):
+        """(W,) mask of the source walls not wholly outside the view frustum.
+
+        Whole figures are rejected through the bounding volume hierarchy
+        first, then the walls of the remaining figures by their boxes. With
+        ordered, the hierarchy is walked back to front and the walk is kept
+        for a following figure_order with the same camera.
+        """
+        visible = np.zeros(len(self.wall_normals), dtype=bool)
+        if ordered:
+            figures_visible = np.zeros(len(self.bvh), dtype=bool)
+            figures_visible[self.figure_walk(camera)] = True
+        else:
+            figures_visible = self.bvh.visible(camera)
+        candidates = np.flatnonzero(figures_visible[self.wall_figure_ids])
+        visible[candidates] = camera.boxes_visible(self.wall_mins[candidates], self.wall_maxs[candidates])
+        return visible
+
+    def depths(self, camera_position, walls=slice(None)):
+        """Distance from the camera to the centroids of the given walls."""
+        return np.linalg.norm(self.centroids[walls] - camera_position, axis=1)
+
+    def select(self, camera_position, visible=None):
+        """Indices and depths of the walls to draw, in storage order.
+
+        visible is an optional (W,) mask of source walls; partitions of hidden
+        source walls are left out.
+        """
+        if visible is None:
+            walls = np.arange(len(self))
+        else:
+            walls = np.flatnonzero(visible[self.wall_ids])
+
+        return walls, self.depths(camera_position, walls)
+
+    def depth_order(self, camera_position, visible=None):
+        """Indices of the walls to draw from the farthest to the nearest, with their depths.
+
+        Walls at equal depth keep storage order. The previous frame's order is
+        reused: unchanged inputs return it as is, otherwise it is repaired with
+        a stable sort, which numpy runs as timsort and which is close to linear
+        on the nearly sorted orders of consecutive frames.
+        """
+        key = (np.asarray(camera_position, dtype=float).tobytes(), None if visible is None else visible.tobytes())
+        if key == self._order_key:
+            return self._order
+
+        walls, depths = self.select(camera_position, visible)
+        wall_depths = np.empty(len(self))
+        wall_depths[walls] = depths
+
+        # Last order without the walls no longer drawn, then the newly drawn ones
+        if self._order is None:
+            sequence = walls
+        elif key[1] == self._order_key[1]:
+            sequence = self._order[0]
+        else:
+            previous = self._order[0]
+            drawn = np.zeros(len(self), dtype=bool)
+            drawn[walls] = True
+            was_drawn = np.zeros(len(self), dtype=bool)
+            was_drawn[previous] = True
+            sequence = np.concatenate([previous[drawn[previous]], walls[~was_drawn[walls]]])
+
+        sequence = sequence[np.argsort(-wall_depths[sequence], kind="stable")]
+        sequence_depths = wall_depths[sequence]
+
+        # Walls at equal depth may come in last frame's order; put them back in storage order
+        ties = sequence_depths[1:] == sequence_depths[:-1]
+        if ties.any():
+            runs = np.concatenate([[0], np.cumsum(~ties)])
+            repaired = np.lexsort((sequence, runs))
+            sequence, sequence_depths = sequence[repaired], sequence_depths[repaired]
+
+        self._order_key = key
+        self._order = sequence, sequence_depths
+        return self._order
+
+    def figure_order(self, camera, visible=None):
+        """Like depth_order, but figures are ordered by a back-to-front walk of the hierarchy.
+
+        Only the walls within each figure are sorted by depth, so the walls of
+        separate figures never interleave.
+        """
+        figures = self.figure_walk(camera)
+        ranks = np.full(len(self.bvh), -1)
+        ranks[figures] = np.arange(len(figures))
+
+        walls, depths = self.select(camera.position, visible)
+        wall_ranks = ranks[self.figure_ids[walls]]
+        kept = wall_ranks >= 0
+        walls, depths, wall_ranks = walls[kept], depths[kept], wall_ranks[kept]
+
+        # Sorted by depth only within each figure's run of walls
+        order = np.lexsort((-depths, wall_ranks))
+        return walls[order], depths[order]
+
+    def figure_walk(self, camera):
+        """Figures inside the view frustum from back to front, reused while the camera is unchanged."""
+        key = camera.state()
+        if key != self._walk_key:
+            self._walk = self.bvh.back_to_front(camera)
+            self._walk_key = key
+        return self._walk
+
+    def project(self, camera, order, depths):
+        """Project the ordered walls to screen walls clipped to the view frustum.
+
+        Walls wholly outside the frustum are dropped. Walls crossing the near
+        plane are clipped; a clipped triangle repeats its last corner and a
+        clipped pentagon is split in two quads.
+        """
+        quads = self.quads[order]
+        used = np.zeros(len(self.vertices), dtype=bool)
+        used[quads] = True
+        view_vertices = np.empty((len(self.vertices), 3))
+        view_vertices[used] = camera.to_view(self.vertices[used])
+        view_walls = view_vertices[quads]
+
+        inside = camera.view_points_visible(view_walls)
+        crossing = inside & (view_walls[:, :, 2] > -camera.near).any(axis=1)
+
+        pieces = {}
+        for i in np.flatnonzero(crossing):
+            polygon = clip_polygon_near(view_walls[i], camera.near)
+            if len(polygon) == 3:
+                pieces[i] = [polygon[[0, 1, 2, 2]]]
+            elif len(polygon) == 4:
+                pieces[i] = [polygon]
+            else:
+                pieces[i] = [polygon[[0, 1, 2, 3]], polygon[[0, 3, 4, 4]]]
+
+        counts = inside.astype(int)
+        for i, wall_pieces in pieces.items():
+            counts[i] = len(wall_pieces)
+
+        walls = np.repeat(np.arange(len(quads)), counts)
+        view_walls = view_walls[walls]
+        offsets = np.cumsum(counts) - counts
+        for i, wall_pieces in pieces.items():
+            view_walls[offsets[i]:offsets[i] + len(wall_pieces)] = wall_pieces
+
+        return ProjectedWalls(order[walls], depths[walls], camera.project_view(view_walls), -view_walls[:, :, 2],
+                              int(used.sum()))
+
+
+def _reduce_groups(ufunc, values, groups, count, identity):
+    """(count, ...) reduction of the rows of values by their group, identity for empty groups.
+
+    Rows already ordered by group, as partitions are, are reduced in runs with
+    reduceat instead of row by row.
+    """
+    result = np.full((count,) + values.shape[1:], identity)
+    if len(groups) and np.all(groups[1:] >= groups[:-1]):
+        starts = np.flatnonzero(np.concatenate([[True], groups[1:] != groups[:-1]]))
+        result[groups[starts]] = ufunc.reduceat(values, starts)
+    else:
+        ufunc.at(result, groups, values)
+    return result
+
+
+# Bytes charged to the partition budget per entry for the bookkeeping around
+# its arrays: array headers, the key and the OrderedDict node
+PARTITION_ENTRY_OVERHEAD = 1024
+
+
+class PartitionCache:
+    """Partitioned walls of whole scenes kept in least recently used order within a memory budget.
+
+    Entries hold the WallStore built for all walls under a key at one
+    partition level, so switching back to a cached level needs no work. The
+    cache remembers the vertex array every key was last partitioned from
+    and drops all levels cached for the key once another array is given;
+    the array is made read-only so it cannot change in place under the cache.
+    """
+
+    def __init__(self, max_bytes=1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._sources = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def partition(self, key, points, n, build):
+        """Return the WallStore that build(n) makes of the walls at points, cached."""
+        if self._sources.get(key) is not points:
+            self.invalidate(key)
+            points.flags.writeable = False
+            self._sources[key] = points
+
+        entry_key = (key, n)
+        entry = self._entries.get(entry_key)
+        if entry is not None:
+            self._entries.move_to_end(entry_key)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        entry = build(n)
+        self._entries[entry_key] = entry
+        self.size += entry.nbytes + PARTITION_ENTRY_OVERHEAD
+        self.evict()
+        return entry
+
+    def invalidate(self, key):
+        """Drop every level cached for key."""
+        for entry_key in [entry_key for entry_key in self._entries if entry_key[0] == key]:
+            self.size -= self._entries.pop(entry_key).nbytes + PARTITION_ENTRY_OVERHEAD
+        self._sources.pop(key, None)
+
+    def evict(self):
+        """Drop the least recently used entries until the cache fits its budget."""
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self.size -= entry.nbytes + PARTITION_ENTRY_OVERHEAD
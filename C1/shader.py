@@ -0,0 +1,59 @@
+from OpenGL.GL import *
+from OpenGL.GL.shaders import compileProgram, compileShader
+import numpy as np
+
+_UNIFORM_SETTERS = {
+    GL_FLOAT: lambda location, value: glUniform1fv(location, 1, value),
+    GL_FLOAT_VEC3: lambda location, value: glUniform3fv(location, 1, value),
+    GL_FLOAT_VEC4: lambda location, value: glUniform4fv(location, 1, value),
+    GL_FLOAT_MAT4: lambda location, value: glUniformMatrix4fv(location, 1, GL_TRUE, value),
+    GL_INT: lambda location, value: glUniform1iv(location, 1, value),
+}
+
+
+class ShaderProgram:
+    """Linked shader program with uniform locations cached at link time.
+
+    set_uniform skips the upload when the value equals the last one sent, and
+    ignores names the linker optimized away. Matrices are given row-major.
+    """
+
+    def __init__(self, vertex_source, fragment_source):
+        self.program = compileProgram(
+            compileShader(vertex_source, GL_VERTEX_SHADER),
+            compileShader(fragment_source, GL_FRAGMENT_SHADER),
+        )
+        self.uniforms = {}
+        self._values = {}
+
+        for index in range(glGetProgramiv(self.program, GL_ACTIVE_UNIFORMS)):
+            name, _, uniform_type = glGetActiveUniform(self.program, index)
+            name = name.decode() if isinstance(name, bytes) else name
+            location = glGetUniformLocation(self.program, name)
+            # Members of uniform blocks have no location
+            if location != -1:
+                self.uniforms[name] = (location, uniform_type)
+
+    def use(self):
+        glUseProgram(self.program)
+
+    def attribute_location(self, name):
+        return glGetAttribLocation(self.program, name)
+
+    def set_uniform(self, name, value):
+        uniform = self.uniforms.get(name)
+        if uniform is None:
+            return
+
+        location, uniform_type = uniform
+        dtype = np.int32 if uniform_type == GL_INT else np.float32
+        value = np.ascontiguousarray(value, dtype=dtype)
+        data = value.tobytes()
+        if self._values.get(name) == data:
+            return
+
+        _UNIFORM_SETTERS[uniform_type](location, value)
+        self._values[name] = data
+
+    def bind_uniform_block(self, name, binding):
+        glUniformBlockBinding(self.program, glGetUniformBlockIndex(self.program, name), binding)
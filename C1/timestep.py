@@ -0,0 +1,23 @@
+class FixedTimestep:
+    """Accumulator running the simulation in steps of a fixed length, independent of the frame rate.
+
+    advance adds the time of a frame and returns how many steps to run for
+    it; alpha is the fraction of a step left over, for drawing the state
+    between the last two steps. Frames longer than max_frame_time are cut
+    short so that a stall is not followed by a burst of steps.
+    """
+
+    def __init__(self, rate=75, max_frame_time=0.25):
+        self.step = 1 / rate
+        self.max_frame_time = max_frame_time
+        self.accumulator = 0.0
+
+    def advance(self, frame_time):
+        self.accumulator += min(frame_time, self.max_frame_time)
+        steps = int(self.accumulator // self.step)
+        self.accumulator -= steps * self.step
+        return steps
+
+    @property
+    def alpha(self):
+        return self.accumulator / self.step
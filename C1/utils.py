@@ -15,6 +15,60 @@ def read_points(filename):
     return data
 
 
+SCENE_MAGIC = b"CGSCENE1"
+# The point data starts at a multiple of this many bytes
+SCENE_ALIGNMENT = 16
+
+
+def write_scene(filename, points):
+    """Write figures as a binary scene: a JSON header with per-figure offsets, then raw float32 points."""
+    figures = []
+    offset = 0
+    for name, figure_points in points.items():
+        count = len(figure_points)
+        figures.append({"name": name, "offset": offset, "count": count})
+        offset += count
+
+    header = json.dumps({"figures": figures}).encode()
+    data_offset = len(SCENE_MAGIC) + 8 + len(header)
+    header += b" " * (-data_offset % SCENE_ALIGNMENT)
+
+    with open(filename, "wb") as file:
+        file.write(SCENE_MAGIC)
+        file.write(np.array(len(header), dtype="<u8").tobytes())
+        file.write(header)
+        for figure_points in points.values():
+            file.write(np.asarray(figure_points, dtype="<f4").reshape(-1, 3).tobytes())
+
+
+def map_scene(filename):
+    """Memory-map a binary scene as its figure names, point counts and one read-only (N, 3) float32 block.
+
+    The points of every figure follow those of the figure before it.
+    """
+    with open(filename, "rb") as file:
+        if file.read(len(SCENE_MAGIC)) != SCENE_MAGIC:
+            raise ValueError(f"{filename} is not a binary scene file")
+        header_size = int(np.frombuffer(file.read(8), dtype="<u8")[0])
+        header = json.loads(file.read(header_size))
+
+    figures = header["figures"]
+    names = [figure["name"] for figure in figures]
+    counts = [figure["count"] for figure in figures]
+    if sum(counts) == 0:
+        return names, counts, np.zeros((0, 3), dtype=np.float32)
+
+    data = np.memmap(filename, dtype="<f4", mode="r", offset=len(SCENE_MAGIC) + 8 + header_size,
+                     shape=(sum(counts), 3))
+    return names, counts, data
+
+
+def is_scene_file(filename):
+    """Whether the file is a binary scene rather than JSON points."""
+    with open(filename, "rb") as file:
+        return file.read(len(SCENE_MAGIC)) == SCENE_MAGIC
+
+
 def rotate_x_scene(point, k):
     """Rotation matrix around the X-axis."""
     cos_k = np.cos(k)
@@ -88,6 +142,132 @@ def transform_point(point, camera_position, camera_rotation, f, zoom=1):
     return centered_point
 
 
+def rotation_matrix(camera_rotation):
+    """Compose the rotation applied by rotate_point into a single 3x3 matrix."""
+    x_angle, y_angle, z_angle = -np.asarray(camera_rotation, dtype=float)
+    cos_x, sin_x = np.cos(x_angle), np.sin(x_angle)
+    cos_y, sin_y = np.cos(y_angle), np.sin(y_angle)
+    cos_z, sin_z = np.cos(z_angle), np.sin(z_angle)
+    rotate_y = np.array([[cos_x, 0, sin_x], [0, 1, 0], [-sin_x, 0, cos_x]])
+    rotate_x = np.array([[1, 0, 0], [0, cos_y, -sin_y], [0, sin_y, cos_y]])
+    rotate_z = np.array([[cos_z, -sin_z, 0], [sin_z, cos_z, 0], [0, 0, 1]])
+    return rotate_z @ rotate_x @ rotate_y
+
+
+_BOX_CORNERS = np.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)], dtype=bool)
+
+
+class Camera:
+    """Camera state with cached view, movement and frustum matrices.
+
+    The matrices are recomposed only when the values they depend on differ
+    from the ones they were last built for, so the arrays may be modified in
+    place. The rotation, movement and frustum matrices do not depend on the
+    position and are kept while only the camera moves.
+    """
+
+    def __init__(self, position=(0.0, 0.0, 0.0), rotation=(0.0, 0.0, 0.0), f=1000, zoom=1, near=1.0):
+        self.position = np.array(position, dtype=float)
+        self.rotation = np.array(rotation, dtype=float)
+        self.f = f
+        self.zoom = zoom
+        self.near = near
+        self._cached_state = None
+        self._cached_orientation = None
+        self._rotation_matrix = None
+        self._view_matrix = None
+        self._movement_matrix = None
+        self._frustum_planes = None
+
+    def state(self):
+        return (*self.position, *self.rotation, self.f, self.zoom, self.near)
+
+    def _update_orientation(self):
+        orientation = (*self.rotation, self.f, self.zoom, self.near)
+        if orientation == self._cached_orientation:
+            return
+
+        scale = self.f * self.zoom
+        self._rotation_matrix = rotation_matrix(self.rotation)
+        self._movement_matrix = rotation_matrix(-self.rotation)
+
+        # Camera-space planes (normal, offset); a point p is inside when normal . p + offset >= 0.
+        # The camera looks down -z, so the near plane is z = -near.
+        half_width, half_height = Display.WIDTH / 2, Display.HEIGHT / 2
+        self._frustum_planes = np.array([
+            [0, 0, -1, -self.near],
+            [-scale, 0, -half_width, 0],
+            [scale, 0, -half_width, 0],
+            [0, -scale, -half_height, 0],
+            [0, scale, -half_height, 0],
+        ])
+        self._cached_orientation = orientation
+
+    def _update(self):
+        state = self.state()
+        if state == self._cached_state:
+            return
+
+        self._update_orientation()
+        rotation = self._rotation_matrix
+        view_matrix = np.identity(4)
+        view_matrix[:3, :3] = rotation
+        view_matrix[:3, 3] = -rotation @ self.position
+
+        self._view_matrix = view_matrix
+        self._cached_state = state
+
+    @property
+    def view_matrix(self):
+        """4x4 matrix moving world points into camera space."""
+        self._update()
+        return self._view_matrix
+
+    @property
+    def frustum_planes(self):
+        """(5, 4) camera-space near, left, right, top and bottom planes; the near plane comes first."""
+        self._update_orientation()
+        return self._frustum_planes
+
+    def to_view(self, points):
+        """Move an (N, 3) array of world points into camera space."""
+        view_matrix = self.view_matrix
+        return np.asarray(points, dtype=float) @ view_matrix[:3, :3].T + view_matrix[:3, 3]
+
+    def project_view(self, view_points):
+        """Project camera-space points in front of the near plane to screen points."""
+        scale = self.f * self.zoom
+        screen_points = view_points[..., :2] * (scale / view_points[..., 2:3])
+        screen_points += (Display.WIDTH / 2, Display.HEIGHT / 2)
+        return screen_points
+
+    def boxes_visible(self, mins, maxs):
+        """Mask of the world-space bounding boxes that are not wholly outside the view frustum."""
+        corners = np.where(_BOX_CORNERS[None, :, :], np.asarray(maxs)[:, None, :], np.asarray(mins)[:, None, :])
+        return self.view_points_visible(self.to_view(corners))
+
+    def view_points_visible(self, view_points):
+        """Mask of the (K, N, 3) camera-space point groups not wholly outside one frustum plane."""
+        planes = self.frustum_planes
+        distances = view_points @ planes[:, :3].T + planes[:, 3]
+        return ~(distances < 0).all(axis=1).any(axis=1)
+
+    def move(self, vector):
+        """Move the camera by a vector given in camera space."""
+        self._update_orientation()
+        self.position += self._movement_matrix @ vector
+
+    def copy(self):
+        return Camera(self.position, self.rotation, self.f, self.zoom, self.near)
+
+    def interpolate(self, previous, current, alpha):
+        """Set this camera between two others; alpha 0 gives previous and 1 gives current."""
+        self.position[:] = previous.position + (current.position - previous.position) * alpha
+        self.rotation[:] = previous.rotation + (current.rotation - previous.rotation) * alpha
+        self.f = previous.f + (current.f - previous.f) * alpha
+        self.zoom = previous.zoom + (current.zoom - previous.zoom) * alpha
+
+
 def distance(point1, point2):
     return np.linalg.norm(np.array(point1) - np.array(point2))
 
@@ -97,6 +277,75 @@ def calculate_depth(polygon, camera_position):
     return distance(centroid, camera_position)
 
 
+def outward_normals(points, walls, centers=None, wound=None):
+    """Unit normals of the walls of a closed figure, pointing away from its centre.
+
+    The direction comes from the figure's centroid, so it does not depend on
+    the winding of the wall index lists. That only holds for convex figures:
+    wound optionally marks the walls whose winding is reliable, counter-clockwise
+    seen from the front as in OBJ files, and those keep the direction it gives.
+    centers optionally gives the (W, 3) centre of the figure of every wall, for
+    walls of several figures at once.
+    """
+    points = np.asarray(points, dtype=float)
+    wall_points = points[np.asarray(walls)]
+    if centers is None:
+        centers = points.mean(axis=0)
+
+    # Newell's method, robust to slightly non-planar walls
+    normals = np.cross(wall_points, np.roll(wall_points, -1, axis=1)).sum(axis=1)
+    outward = wall_points.mean(axis=1) - centers
+    flip = np.einsum("ij,ij->i", normals, outward) < 0
+    if wound is not None:
+        flip &= ~np.asarray(wound, dtype=bool)
+    normals[flip] *= -1
+
+    return normals / np.linalg.norm(normals, axis=1, keepdims=True)
+
+
+def mono_shading_table(light_strength):
+    """(n, 3) uint8 gray levels indexed by depth // 5; deeper walls use the last, black entry."""
+    buckets = np.arange(int(np.ceil(255 * light_strength)) + 1)
+    darkness = np.clip(255 - buckets / light_strength, 0, 255).astype(np.uint8)
+    return np.repeat(darkness[:, None], 3, axis=1)
+
+
+def clip_polygon_near(polygon, near):
+    """Clip a camera-space polygon to the part in front of the near plane (Sutherland-Hodgman)."""
+    clipped = []
+    previous = polygon[-1]
+    previous_inside = previous[2] <= -near
+    for current in polygon:
+        current_inside = current[2] <= -near
+        if current_inside != previous_inside:
+            t = (-near - previous[2]) / (current[2] - previous[2])
+            clipped.append(previous + t * (current - previous))
+        if current_inside:
+            clipped.append(current)
+        previous, previous_inside = current, current_inside
+
+    return np.array(clipped).reshape(-1, 3)
+
+
+def clip_segments_near(segments, near):
+    """Clip (K, 2, 3) camera-space segments to the near plane, dropping the ones wholly behind it."""
+    segments = np.array(segments, dtype=float).reshape(-1, 2, 3)
+    inside = segments[:, :, 2] <= -near
+    segments = segments[inside.any(axis=1)]
+    inside = inside[inside.any(axis=1)]
+
+    start, end = segments[:, 0], segments[:, 1]
+    crossing = ~inside.all(axis=1)
+    t = (-near - start[crossing, 2]) / (end[crossing, 2] - start[crossing, 2])
+    intersection = start[crossing] + t[:, None] * (end[crossing] - start[crossing])
+
+    # Replace whichever end of a crossing segment lies behind the near plane
+    start_behind = ~inside[crossing, 0]
+    segments[np.flatnonzero(crossing)[start_behind], 0] = intersection[start_behind]
+    segments[np.flatnonzero(crossing)[~start_behind], 1] = intersection[~start_behind]
+    return segments
+
+
 def get_middle_point(p1, p2):
     return [(p1[0] + p2[0]) / 2, (p1[1] + p2[1]) / 2, (p1[2] + p2[2]) / 2]
 
@@ -130,3 +379,83 @@ def partition_polygon(points, n=1):
         polygons = new_polygons
 
     return polygons
+
+
+def partition_mesh(vertices, polygons, n=1):
+    """Subdivide the (W, 4) quads of a mesh n times, sharing grid vertices between quads.
+
+    Every quad becomes a (2^n + 1)^2 grid of bilinearly interpolated points,
+    whose sub-quads are wound like the quad; for parallelograms, such as cube
+    walls, they match the ones from partition_polygon. The corners stay the
+    mesh vertices and the grid points along an edge are made once for all
+    quads around it, so every point is stored and transformed once. Returns
+    the vertices, starting with the mesh's own, and the (4^n * W, 4) vertex
+    indices of the sub-quads, grid after grid.
+    """
+    vertices = np.asarray(vertices, dtype=float).reshape(-1, 3)
+    polygons = np.asarray(polygons, dtype=int).reshape(-1, 4)
+    weights, template = _partition_template(n)
+    size = 2 ** n
+    wall_count = len(polygons)
+
+    # Grid of vertex indices of every quad; corners are the mesh vertices
+    grid = np.empty((wall_count, size + 1, size + 1), dtype=int)
+    grid[:, 0, 0], grid[:, 0, size], grid[:, size, size], grid[:, size, 0] = polygons.T
+    new_vertices = [vertices]
+
+    if size > 1:
+        # The edges along the first row, last column, last row and first column of the grids
+        pairs = np.stack([polygons[:, [0, 1, 3, 0]], polygons[:, [1, 2, 2, 3]]], axis=2).reshape(-1, 2)
+        keys = np.sort(pairs, axis=1)
+        codes, edge_ids = np.unique(keys[:, 0] * len(vertices) + keys[:, 1], return_inverse=True)
+        edges = np.stack(np.divmod(codes, len(vertices)), axis=1)
+        edge_ids = edge_ids.reshape(-1)
+
+        t = np.arange(1, size) / size
+        edge_points = (1 - t)[:, None] * vertices[edges[:, :1]] + t[:, None] * vertices[edges[:, 1:]]
+        new_vertices.append(edge_points.reshape(-1, 3))
+
+        # Edges run from their lower vertex index; a quad walking one the other way reads it backwards
+        steps = np.where((pairs[:, 0] == keys[:, 0])[:, None], np.arange(size - 1), np.arange(size - 2, -1, -1))
+        ids = len(vertices) + edge_ids[:, None] * (size - 1) + steps
+        # The repeated corner of a padded triangle has no points between
+        degenerate = pairs[:, 0] == pairs[:, 1]
+        ids[degenerate] = pairs[degenerate, :1]
+        ids = ids.reshape(wall_count, 4, size - 1)
+        grid[:, 0, 1:size] = ids[:, 0]
+        grid[:, 1:size, size] = ids[:, 1]
+        grid[:, size, 1:size] = ids[:, 2]
+        grid[:, 1:size, 0] = ids[:, 3]
+
+        interior_weights = weights.reshape(size + 1, size + 1, 4)[1:size, 1:size].reshape(-1, 4)
+        interior_points = interior_weights @ vertices[polygons]
+        grid[:, 1:size, 1:size] = (len(vertices) + len(edge_points.reshape(-1, 3))
+                                   + np.arange(interior_points.size // 3).reshape(wall_count, size - 1, size - 1))
+        new_vertices.append(interior_points.reshape(-1, 3))
+
+    quads = grid.reshape(wall_count, -1)[:, template].reshape(-1, 4)
+    return np.concatenate(new_vertices), quads
+
+
+_partition_templates = {}
+
+
+def _partition_template(n):
+    """Bilinear corner weights of the grid vertices and the sub-quads of one level-n grid."""
+    template = _partition_templates.get(n)
+    if template is not None:
+        return template
+
+    size = 2 ** n
+    steps = np.linspace(0, 1, size + 1)
+    v, u = np.meshgrid(steps, steps, indexing="ij")
+    u = u.reshape(-1)
+    v = v.reshape(-1)
+    weights = np.stack([(1 - u) * (1 - v), u * (1 - v), u * v, (1 - u) * v], axis=1)
+
+    corners = np.arange(size + 1) * (size + 1)
+    corners = (corners[:size, None] + np.arange(size)).reshape(-1)
+    quads = np.stack([corners, corners + 1, corners + size + 2, corners + size + 1], axis=1)
+
+    template = _partition_templates[n] = (weights, quads)
+    return template
@@ -1,24 +1,35 @@
 import pygame
 import sys
 import numpy as np
-from utils import read_points, project_point, rotate_point, rotate_vector, transform_point
+from utils import Camera, clip_segments_near
+from mesh import load_buffers
+from hud import TextCache
+from timestep import FixedTimestep
 from constants import *
 
 
+# Simulation steps per second; the speeds were per frame at the old 1000 FPS cap
+STEP_RATE = 1000
+
+
 class CameraSimulation:
-    def __init__(self):
+    def __init__(self, points_file="points.txt"):
         pygame.init()
         self.screen = pygame.display.set_mode((Display.WIDTH, Display.HEIGHT))
         pygame.display.set_caption("3D Camera Simulation")
-        self.camera_position = np.array([0.0, 50, 750])
-        self.camera_rotation = np.array([0.0, 0.0, 0.0])
-        self.zoom = 1
-        self.f = 1000
+        self.scene_surface = self.screen.copy()
+        self.drawn_scene_state = None
+        self.camera = Camera(position=(0.0, 50, 750))
+        # Input moves the simulated camera in fixed steps; self.camera is drawn between its last two states
+        self.simulated_camera = self.camera.copy()
+        self.previous_camera = self.camera.copy()
+        self.timestep = FixedTimestep(STEP_RATE)
         self.speed_up = 10
         self.rotation_angle = 0.0001
         self.display_table = False
-        self.points = read_points("points.txt")
+        self.buffers = load_buffers(points_file)
         self.font = pygame.font.Font(None, 24)
+        self.text_cache = TextCache(self.font, Colors.WHITE)
         self.clock = pygame.time.Clock()
         self.move_vectors = {
             "forward": np.array([0.0, 0.0, -0.5]),
@@ -29,29 +40,39 @@ class CameraSimulation:
             "down": np.array([0.0, 0.5, 0.0]),
         }
 
-    def handle_input(self):
+    def handle_input(self, steps=0):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
 
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                self.drawn_scene_state = None
+
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_h:
                     self.display_table = not self.display_table
 
         keys = pygame.key.get_pressed()
+        for _ in range(steps):
+            self.step(keys)
+
+    def step(self, keys):
+        """Advance the simulated camera by one fixed step of held keys."""
+        self.previous_camera = self.simulated_camera.copy()
+
         if keys[pygame.K_p]:
             self.higher_zoom()
         if keys[pygame.K_m]:
             self.lower_zoom()
         if keys[pygame.K_RIGHT]:
-            self.camera_rotation[0] += self.rotation_angle * self.speed_up
+            self.simulated_camera.rotation[0] += self.rotation_angle * self.speed_up
         if keys[pygame.K_LEFT]:
-            self.camera_rotation[0] -= self.rotation_angle * self.speed_up
+            self.simulated_camera.rotation[0] -= self.rotation_angle * self.speed_up
         if keys[pygame.K_UP]:
-            self.camera_rotation[1] += self.rotation_angle * self.speed_up
+            self.simulated_camera.rotation[1] += self.rotation_angle * self.speed_up
         if keys[pygame.K_DOWN]:
-            self.camera_rotation[1] -= self.rotation_angle * self.speed_up
+            self.simulated_camera.rotation[1] -= self.rotation_angle * self.speed_up
         if keys[pygame.K_w]:
             self.move_camera("forward")
         if keys[pygame.K_s]:
@@ -65,9 +86,9 @@ class CameraSimulation:
         if keys[pygame.K_e]:
             self.move_camera("down")
         if keys[pygame.K_x]:
-            self.f -= 0.1
+            self.simulated_camera.f -= 0.1
         if keys[pygame.K_z]:
-            self.f += 0.1
+            self.simulated_camera.f += 0.1
         if keys[pygame.K_EQUALS]:
             self.speed_up = min(self.speed_up + 1, 10)
         if keys[pygame.K_MINUS]:
@@ -76,78 +97,109 @@ class CameraSimulation:
             self.reset_camera()
 
     def move_camera(self, direction):
-        move = rotate_vector(self.get_move_vector(direction), self.camera_rotation)
-        self.camera_position += move
+        self.simulated_camera.move(self.get_move_vector(direction))
 
     def get_move_vector(self, direction):
         return self.move_vectors[direction]
 
     def higher_zoom(self):
-        if self.zoom < 10:
-            self.zoom += 0.001
+        if self.simulated_camera.zoom < 10:
+            self.simulated_camera.zoom += 0.001
 
     def lower_zoom(self):
-        if self.zoom > 0.1:
-            self.zoom -= 0.001
+        if self.simulated_camera.zoom > 0.1:
+            self.simulated_camera.zoom -= 0.001
 
     def draw_table(self):
-        text = self.font.render("Camera Position:", True, Colors.WHITE)
-        self.screen.blit(text, (10, 10))
-        text = self.font.render(f"X: {self.camera_position[0]:.2f}", True, Colors.WHITE)
-        self.screen.blit(text, (10, 40))
-        text = self.font.render(f"Y: {self.camera_position[1]:.2f}", True, Colors.WHITE)
-        self.screen.blit(text, (10, 70))
-        text = self.font.render(f"Z: {self.camera_position[2]:.2f}", True, Colors.WHITE)
-        self.screen.blit(text, (10, 100))
-        text = self.font.render(
-            f"Camera Rotation: {'°, '.join([str(round(float(i) * 180, 2)) for i in self.camera_rotation])}",
-            True,
-            Colors.WHITE,
+        """Draw the HUD and return the screen rectangles it covers."""
+        rects = []
+        text = self.text_cache.render("Camera Position:")
+        rects.append(self.screen.blit(text, (10, 10)))
+        text = self.text_cache.render(f"X: {self.camera.position[0]:.2f}")
+        rects.append(self.screen.blit(text, (10, 40)))
+        text = self.text_cache.render(f"Y: {self.camera.position[1]:.2f}")
+        rects.append(self.screen.blit(text, (10, 70)))
+        text = self.text_cache.render(f"Z: {self.camera.position[2]:.2f}")
+        rects.append(self.screen.blit(text, (10, 100)))
+        text = self.text_cache.render(
+            f"Camera Rotation: {'°, '.join([str(round(float(i) * 180, 2)) for i in self.camera.rotation])}"
         )
-        self.screen.blit(text, (10, 130))
-        text = self.font.render(f"Zoom: {self.zoom:.2f}", True, Colors.WHITE)
-        self.screen.blit(text, (10, 160))
-        text = self.font.render(f"Focal Length: {self.f:.2f}", True, Colors.WHITE)
-        self.screen.blit(text, (10, 190))
-        text = self.font.render(f"Speed Up: {self.speed_up}", True, Colors.WHITE)
-        self.screen.blit(text, (10, 220))
-        text = self.font.render(f"FPS: {int(self.clock.get_fps())}", True, Colors.WHITE)
-        self.screen.blit(text, (10, 250))
+        rects.append(self.screen.blit(text, (10, 130)))
+        text = self.text_cache.render(f"Zoom: {self.camera.zoom:.2f}")
+        rects.append(self.screen.blit(text, (10, 160)))
+        text = self.text_cache.render(f"Focal Length: {self.camera.f:.2f}")
+        rects.append(self.screen.blit(text, (10, 190)))
+        text = self.text_cache.render(f"Speed Up: {self.speed_up}")
+        rects.append(self.screen.blit(text, (10, 220)))
+        text = self.text_cache.render(f"FPS: {int(self.clock.get_fps())}")
+        rects.append(self.screen.blit(text, (10, 250)))
+
+        return rects
 
     def draw_all_points(self):
-        for key in self.points:
-            figure_points = self.points[key]
-            self.draw_figure(figure_points)
+        self.draw_figures(self.transform_figures())
+
+    def transform_figures(self):
+        """(K, 2, 2) screen-space edge segments of all figures inside the view frustum."""
+        buffers = self.buffers
+        visible = self.camera.boxes_visible(buffers.figure_mins, buffers.figure_maxs)
+        scene_edges = buffers.scene_edges[visible[buffers.edge_figure_ids]]
+
+        # Every shared vertex is transformed once, then gathered into edges
+        used = np.zeros(len(buffers.vertices), dtype=bool)
+        used[scene_edges] = True
+        view_vertices = np.empty((len(buffers.vertices), 3))
+        view_vertices[used] = self.camera.to_view(buffers.vertices[used])
+
+        segments = clip_segments_near(view_vertices[scene_edges], self.camera.near)
+        return self.camera.project_view(segments)
 
-    def draw_figure(self, figure_points):
-        transformed_points = []
-        for point in figure_points:
-            transformed_point = transform_point(point, self.camera_position, self.camera_rotation, self.f, self.zoom)
-            transformed_points.append(transformed_point)
-        for i, edge in enumerate(edges):
-            self.draw_edge(edge, transformed_points, Colors.WHITE)
+    def draw_figures(self, segments):
+        for segment in segments:
+            self.draw_edge(segment, Colors.WHITE)
 
-    def draw_edge(self, edge, points, color):
-        pygame.draw.line(self.screen, color, points[edge[0]], points[edge[1]])
+    def draw_edge(self, segment, color):
+        pygame.draw.line(self.screen, color, segment[0], segment[1])
 
     def reset_camera(self):
-        self.camera_position = np.array([0.0, 50, 750])
-        self.camera_rotation = np.array([0.0, 0.0, 0.0])
-        self.zoom = 1
+        self.camera = Camera(position=(0.0, 50, 750))
+        self.simulated_camera = self.camera.copy()
+        self.previous_camera = self.camera.copy()
         self.rotation_angle = 0.0001
-        self.f = 1000
         self.speed_up = 10
 
     def run_simulation(self):
+        table_rects = []
         while True:
-            self.screen.fill(Colors.BLACK)
-            self.handle_input()
-            self.draw_all_points()
-            if self.display_table:
-                self.draw_table()
-            pygame.display.flip()
-
-            self.clock.tick(1000)
+            self.handle_input(self.timestep.advance(self.clock.tick(1000) / 1000))
+            self.camera.interpolate(self.previous_camera, self.simulated_camera, self.timestep.alpha)
+
+            scene_state = self.camera.state()
+            scene_changed = scene_state != self.drawn_scene_state
+            if scene_changed:
+                self.screen.fill(Colors.BLACK)
+                self.draw_all_points()
+                self.scene_surface.blit(self.screen, (0, 0))
+                self.drawn_scene_state = scene_state
+            else:
+                # Uncover the scene under the previous table
+                for rect in table_rects:
+                    self.screen.blit(self.scene_surface, rect, rect)
+
+            previous_table_rects = table_rects
+            table_rects = self.draw_table() if self.display_table else []
+
+            if scene_changed:
+                pygame.display.flip()
+            else:
+                pygame.display.update(previous_table_rects + table_rects)
+
+            # Held keys keep stepping even in frames where no step falls due
+            at_rest = self.previous_camera.state() == self.simulated_camera.state()
+            if not scene_changed and at_rest and not any(pygame.key.get_pressed()):
+                # Sleep until the next event, leaving it queued for handle_input, and time the next frame from now
+                pygame.event.post(pygame.event.wait())
+                self.clock.tick()
 
 
 if __name__ == "__main__":
@@ -3,43 +3,37 @@ import random
 import pygame
 import sys
 import numpy as np
-from utils import read_points, transform_point, rotate_vector, calculate_depth, \
-    partition_polygon
+from utils import Camera, outward_normals, mono_shading_table, partition_mesh
+from scene import WallStore, PartitionCache
+from mesh import load_buffers
+from bvh import FigureBVH
+from profiling import FrameProfiler
+from timestep import FixedTimestep
+from pipeline import FramePipeline
+from raster import ZBufferRenderer
+from hud import TextCache
 from constants import *
 
 
-class Figure:
-    def __init__(self, points, edges, walls, name):
-        self.points = points
-        self.edges = edges
-        self.walls = walls
-        self.name = name
-
-    def get_walls(self):
-        walls_as_points = []
-        for wall in self.walls:
-            walls_as_points.append([self.points[point] for point in wall])
-
-        return walls_as_points
-
-    def get_edges(self):
-        edges_as_points = []
-        for edge in self.edges:
-            edges_as_points.append([self.points[point] for point in edge])
-
-        return edges_as_points
+# Simulation steps per second; speeds were tuned for 75 frames per second
+STEP_RATE = 75
 
 
 class CameraSimulation:
-    def __init__(self, partition_factor=3):
+    def __init__(self, partition_factor=3, partition_cache_bytes=1024 * 1024 * 1024, points_file="points.txt",
+                 pipeline_latency=0):
         pygame.init()
         self.screen = pygame.display.set_mode((Display.WIDTH, Display.HEIGHT))
+        self.alpha_layer = pygame.Surface(self.screen.get_size(), pygame.SRCALPHA)
+        self.scene_surface = self.screen.copy()
+        self.drawn_scene_state = None
         pygame.display.set_caption("3D Camera Simulation")
-        self.camera_position = np.array([0.0, 50, 750])
-        self.camera_rotation = np.array([0.0, 0.0, 0.0])
-        self.zoom = 1
+        self.camera = Camera(position=(0.0, 50, 750))
+        # Input moves the simulated camera in fixed steps; self.camera is drawn between its last two states
+        self.simulated_camera = self.camera.copy()
+        self.previous_camera = self.camera.copy()
+        self.timestep = FixedTimestep(STEP_RATE)
         self.partition_factor = partition_factor
-        self.f = 1000
         self.speed_up = 75
         self.rotation_angle = 0.0001
         self.display_table = False
@@ -47,13 +41,29 @@ class CameraSimulation:
         self.draw_walls = True
         self.draw_solid_walls = True
         self.color_walls = True
+        self.cull_back_faces = True
+        self.zbuffer = False
+        self.hierarchy_order = False
+        if pipeline_latency not in (0, 1):
+            raise ValueError("pipeline_latency must be 0 or 1 frames")
+        # With a latency of 1 frame, walls are culled, sorted and projected on a worker thread
+        self.pipeline_latency = pipeline_latency
+        self.pipeline = FramePipeline(self.prepare_walls)
+        self.drawn_camera_state = None
+        self.zbuffer_renderer = ZBufferRenderer(Display.WIDTH, Display.HEIGHT)
         self.font = pygame.font.Font(None, 24)
+        self.text_cache = TextCache(self.font, Colors.WHITE)
         self.clock = pygame.time.Clock()
-        self.points = read_points("points.txt")
-        self.figures = self.create_figures()
-        self.walls = self.get_walls()
+        self.profiler = FrameProfiler()
+        self.buffers = load_buffers(points_file)
+        self.build_walls()
+        self.partition_cache = PartitionCache(partition_cache_bytes)
         self.partitioned_walls = self.partition_walls()
         self.light_strength = 1
+        self.simulated_light_strength = self.light_strength
+        self.previous_light_strength = self.light_strength
+        self.mono_table = None
+        self.mono_table_strength = None
         self.move_vectors = {
             "forward": np.array([0.0, 0.0, -0.05]),
             "backward": np.array([0.0, 0.0, 0.05]),
@@ -63,43 +73,39 @@ class CameraSimulation:
             "down": np.array([0.0, 0.05, 0.0]),
         }
 
-    def create_figures(self):
-        figures = []
-        for figure_id, key in enumerate(self.points):
-            figure_points = self.points[key]
-            figure_edges = []
-            figure_walls = []
-            for i, edge in enumerate(edges):
-                figure_edges.append(edge)
-            for i, wall in enumerate(walls):
-                figure_walls.append(wall)
-            figures.append(Figure(figure_points, figure_edges, figure_walls, key))
-
-        return figures
-
-    def get_walls(self):
-        figure_walls = []
-
-        for figure_id, figure in enumerate(self.figures):
-            figure_walls.extend([(figure_id, wall) for wall in figure.get_walls()])
-
-        return figure_walls
+    def build_walls(self):
+        """Corner points, figures, outward normals and centres of all walls, which no partition level changes."""
+        buffers = self.buffers
+        self.wall_points = buffers.vertices[buffers.scene_polygons].astype(float)
+        self.wall_figure_ids = buffers.polygon_figure_ids
+        self.wall_normals = outward_normals(buffers.vertices, buffers.scene_polygons,
+                                            buffers.figure_centers[buffers.polygon_figure_ids],
+                                            buffers.polygon_wound)
+        self.wall_centers = self.wall_points.mean(axis=1)
+        self.figure_bvh = FigureBVH(buffers.figure_mins, buffers.figure_maxs)
 
     def partition_walls(self):
-        partitioned_walls = []
+        return self.partition_cache.partition("walls", self.buffers.vertices, self.partition_factor,
+                                              self.build_partition)
 
-        for figure_id, wall in self.walls:
-            partitioned_walls.extend(
-                [(figure_id, smaller_wall) for smaller_wall in partition_polygon(wall, self.partition_factor)])
+    def build_partition(self, n):
+        vertices, quads = partition_mesh(self.buffers.vertices, self.buffers.scene_polygons, n)
+        quads_per_wall = 4 ** n
+        figure_ids = np.repeat(self.wall_figure_ids, quads_per_wall)
+        wall_ids = np.repeat(np.arange(len(self.wall_points)), quads_per_wall)
 
-        return partitioned_walls
+        return WallStore(vertices, quads, figure_ids, wall_ids, self.wall_normals, self.wall_centers,
+                         self.figure_bvh)
 
-    def handle_input(self):
+    def handle_input(self, steps=0):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
 
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                self.drawn_scene_state = None
+
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_h:
                     self.display_table = not self.display_table
@@ -111,28 +117,47 @@ class CameraSimulation:
                     self.draw_walls = not self.draw_walls
                 if event.key == pygame.K_4:
                     self.color_walls = not self.color_walls
+                if event.key == pygame.K_5:
+                    self.zbuffer = not self.zbuffer
+                if event.key == pygame.K_b:
+                    self.cull_back_faces = not self.cull_back_faces
+                if event.key == pygame.K_o:
+                    self.hierarchy_order = not self.hierarchy_order
+                if event.key == pygame.K_l:
+                    self.pipeline_latency = 1 - self.pipeline_latency
+                    self.pipeline.drain()
+                if event.key == pygame.K_t:
+                    self.profiler.toggle()
+                if event.key == pygame.K_y and self.profiler.enabled:
+                    self.profiler.dump_trace("frame_trace.json")
                 if event.key == pygame.K_x:
                     self.partition_factor = max(1, self.partition_factor - 1)
-                    self.walls = self.get_walls()
                     self.partitioned_walls = self.partition_walls()
                 if event.key == pygame.K_z:
                     self.partition_factor += 1
-                    self.walls = self.get_walls()
                     self.partitioned_walls = self.partition_walls()
 
         keys = pygame.key.get_pressed()
+        for _ in range(steps):
+            self.step(keys)
+
+    def step(self, keys):
+        """Advance the simulated camera and light by one fixed step of held keys."""
+        self.previous_camera = self.simulated_camera.copy()
+        self.previous_light_strength = self.simulated_light_strength
+
         if keys[pygame.K_p]:
             self.higher_zoom()
         if keys[pygame.K_m]:
             self.lower_zoom()
         if keys[pygame.K_RIGHT]:
-            self.camera_rotation[0] += (self.rotation_angle * self.get_speed_up()) % (2 * np.pi)
+            self.simulated_camera.rotation[0] += (self.rotation_angle * self.speed_up) % (2 * np.pi)
         if keys[pygame.K_LEFT]:
-            self.camera_rotation[0] -= (self.rotation_angle * self.get_speed_up()) % (2 * np.pi)
+            self.simulated_camera.rotation[0] -= (self.rotation_angle * self.speed_up) % (2 * np.pi)
         if keys[pygame.K_UP]:
-            self.camera_rotation[1] += (self.rotation_angle * self.get_speed_up()) % (2 * np.pi)
+            self.simulated_camera.rotation[1] += (self.rotation_angle * self.speed_up) % (2 * np.pi)
         if keys[pygame.K_DOWN]:
-            self.camera_rotation[1] -= (self.rotation_angle * self.get_speed_up()) % (2 * np.pi)
+            self.simulated_camera.rotation[1] -= (self.rotation_angle * self.speed_up) % (2 * np.pi)
         if keys[pygame.K_w]:
             self.move_camera("forward")
         if keys[pygame.K_s]:
@@ -146,9 +171,9 @@ class CameraSimulation:
         if keys[pygame.K_e]:
             self.move_camera("down")
         if keys[pygame.K_c]:
-            self.light_strength += 0.01
+            self.simulated_light_strength += 0.01
         if keys[pygame.K_v]:
-            self.light_strength = max(0.01, self.light_strength - 0.01)
+            self.simulated_light_strength = max(0.01, self.simulated_light_strength - 0.01)
         if keys[pygame.K_EQUALS]:
             self.speed_up = self.speed_up * 1.01 if self.speed_up < 1000 else 1000
         if keys[pygame.K_MINUS]:
@@ -157,167 +182,271 @@ class CameraSimulation:
             self.reset_camera()
 
     def move_camera(self, direction):
-        move = rotate_vector(self.get_move_vector(direction), self.camera_rotation)
-        move = move * self.get_speed_up()
-        self.camera_position += move
+        move = self.get_move_vector(direction)
+        move = move * self.speed_up
+        self.simulated_camera.move(move)
 
     def get_move_vector(self, direction):
         return self.move_vectors[direction]
 
     def higher_zoom(self):
-        if self.zoom < 10:
-            self.zoom += 0.001
+        if self.simulated_camera.zoom < 10:
+            self.simulated_camera.zoom += 0.001
 
     def lower_zoom(self):
-        if self.zoom > 0.1:
-            self.zoom -= 0.001
+        if self.simulated_camera.zoom > 0.1:
+            self.simulated_camera.zoom -= 0.001
 
     def draw_table(self):
-        text = self.font.render("Camera Position:", True, Colors.WHITE)
-        self.screen.blit(text, (10, 10))
-        text = self.font.render(f"X: {self.camera_position[0]:.2f}", True, Colors.WHITE)
-        self.screen.blit(text, (10, 40))
-        text = self.font.render(f"Y: {self.camera_position[1]:.2f}", True, Colors.WHITE)
-        self.screen.blit(text, (10, 70))
-        text = self.font.render(f"Z: {self.camera_position[2]:.2f}", True, Colors.WHITE)
-        self.screen.blit(text, (10, 100))
-        text = self.font.render(
-            f"Camera Rotation: {'°, '.join([str(round(float(i) * 180, 2)) for i in self.camera_rotation])}",
-            True,
-            Colors.WHITE,
+        """Draw the HUD and return the screen rectangles it covers."""
+        rects = []
+        text = self.text_cache.render("Camera Position:")
+        rects.append(self.screen.blit(text, (10, 10)))
+        text = self.text_cache.render(f"X: {self.camera.position[0]:.2f}")
+        rects.append(self.screen.blit(text, (10, 40)))
+        text = self.text_cache.render(f"Y: {self.camera.position[1]:.2f}")
+        rects.append(self.screen.blit(text, (10, 70)))
+        text = self.text_cache.render(f"Z: {self.camera.position[2]:.2f}")
+        rects.append(self.screen.blit(text, (10, 100)))
+        text = self.text_cache.render(
+            f"Camera Rotation: {'°, '.join([str(round(float(i) * 180, 2)) for i in self.camera.rotation])}"
         )
-        self.screen.blit(text, (10, 130))
-        text = self.font.render(f"Zoom: {self.zoom:.2f}", True, Colors.WHITE)
-        self.screen.blit(text, (10, 160))
-        text = self.font.render(f"Focal Length: {self.f:.2f}", True, Colors.WHITE)
-        self.screen.blit(text, (10, 190))
-        text = self.font.render(f"Speed Up: {self.speed_up}", True, Colors.WHITE)
-        self.screen.blit(text, (10, 220))
-        text = self.font.render(f"FPS: {int(self.clock.get_fps())}", True, Colors.WHITE)
-        self.screen.blit(text, (10, 250))
-        text = self.font.render(f"Draw edges: {self.draw_edges}", True, Colors.WHITE)
-        self.screen.blit(text, (10, 280))
-        text = self.font.render(f"Draw solid walls: {self.draw_solid_walls} [2]", True, Colors.WHITE)
-        self.screen.blit(text, (10, 310))
-        text = self.font.render(f"Draw walls: {self.draw_walls} [3]", True, Colors.WHITE)
-        self.screen.blit(text, (10, 340))
-        text = self.font.render(f"Draw color walls: {self.color_walls} [4]", True, Colors.WHITE)
-        self.screen.blit(text, (10, 370))
-        text = self.font.render(f"Partition factor: {self.partition_factor} [z/x]", True, Colors.WHITE)
-        self.screen.blit(text, (10, 400))
-        text = self.font.render(f"Light strength: {self.light_strength:.2f} [c/v]", True, Colors.WHITE)
-        self.screen.blit(text, (10, 430))
-        text = self.font.render("Press H to hide this table", True, Colors.WHITE)
-        self.screen.blit(text, (10, 470))
+        rects.append(self.screen.blit(text, (10, 130)))
+        text = self.text_cache.render(f"Zoom: {self.camera.zoom:.2f}")
+        rects.append(self.screen.blit(text, (10, 160)))
+        text = self.text_cache.render(f"Focal Length: {self.camera.f:.2f}")
+        rects.append(self.screen.blit(text, (10, 190)))
+        text = self.text_cache.render(f"Speed Up: {self.speed_up}")
+        rects.append(self.screen.blit(text, (10, 220)))
+        text = self.text_cache.render(f"FPS: {int(self.clock.get_fps())}")
+        rects.append(self.screen.blit(text, (10, 250)))
+        text = self.text_cache.render(f"Draw edges: {self.draw_edges}")
+        rects.append(self.screen.blit(text, (10, 280)))
+        text = self.text_cache.render(f"Draw solid walls: {self.draw_solid_walls} [2]")
+        rects.append(self.screen.blit(text, (10, 310)))
+        text = self.text_cache.render(f"Draw walls: {self.draw_walls} [3]")
+        rects.append(self.screen.blit(text, (10, 340)))
+        text = self.text_cache.render(f"Draw color walls: {self.color_walls} [4]")
+        rects.append(self.screen.blit(text, (10, 370)))
+        text = self.text_cache.render(f"Z-buffer renderer: {self.zbuffer} [5]")
+        rects.append(self.screen.blit(text, (10, 400)))
+        text = self.text_cache.render(f"Cull back faces: {self.cull_back_faces} [b]")
+        rects.append(self.screen.blit(text, (10, 430)))
+        text = self.text_cache.render(f"Partition factor: {self.partition_factor} [z/x]")
+        rects.append(self.screen.blit(text, (10, 460)))
+        text = self.text_cache.render(f"Light strength: {self.light_strength:.2f} [c/v]")
+        rects.append(self.screen.blit(text, (10, 490)))
+        text = self.text_cache.render(f"Order figures by hierarchy: {self.hierarchy_order} [o]")
+        rects.append(self.screen.blit(text, (10, 520)))
+        text = self.text_cache.render(f"Pipeline latency: {self.pipeline_latency} frame [l]")
+        rects.append(self.screen.blit(text, (10, 550)))
+        text = self.text_cache.render("Press H to hide this table")
+        rects.append(self.screen.blit(text, (10, 590)))
+        text = self.text_cache.render(f"Profiler: {self.profiler.enabled} [t], save trace [y]")
+        rects.append(self.screen.blit(text, (10, 620)))
+        if self.profiler.enabled:
+            # Second column, the first one reaches the bottom of the screen
+            for i, line in enumerate(self.profiler.summary_lines()):
+                text = self.text_cache.render(line)
+                rects.append(self.screen.blit(text, (Display.WIDTH - 390, 10 + 20 * i)))
+
+        return rects
 
     def draw_all_walls(self):
-        self.partitioned_walls.sort(key=lambda pair: calculate_depth(pair[1], self.camera_position), reverse=True)
-
+        if self.pipeline_latency:
+            with self.profiler.stage("pipeline wait"):
+                self.drawn_camera_state, projected_walls = self.pipeline.next_frame(
+                    (self.camera.copy(), self.partitioned_walls), self.projection_settings())
+        else:
+            with self.profiler.stage("cull"):
+                visible = self.visible_walls()
+            with self.profiler.stage("sort"):
+                order, depths = self.sort_walls(visible)
+            with self.profiler.stage("transform"):
+                projected_walls = self.transform_walls(order, depths)
+            self.drawn_camera_state = self.camera.state()
+
+        with self.profiler.stage("fill"):
+            self.fill_walls(projected_walls)
+
+        self.profiler.count("walls drawn", len(projected_walls.order) if self.draw_walls else 0)
+        self.profiler.count("vertices transformed", projected_walls.transformed_vertices)
+
+    def projection_settings(self):
+        """Settings the projected walls depend on besides the camera."""
+        return (self.partitioned_walls, self.cull_back_faces, self.draw_solid_walls, self.uses_zbuffer(),
+                self.hierarchy_order)
+
+    def prepare_walls(self, frame):
+        """Cull, sort and project the walls for a (camera, walls) frame; runs on the pipeline thread."""
+        camera, walls = frame
+        visible = self.visible_walls(camera, walls)
+        order, depths = self.sort_walls(visible, camera, walls)
+        return camera.state(), self.transform_walls(order, depths, camera, walls)
+
+    def visible_walls(self, camera=None, walls=None):
+        """Mask of the source walls inside the view frustum and, in solid mode, facing the camera."""
+        if camera is None:
+            camera = self.camera
+        if walls is None:
+            walls = self.partitioned_walls
+        visible = walls.in_frustum(camera, ordered=self.hierarchy_order and not self.uses_zbuffer())
+        if self.cull_back_faces and self.draw_solid_walls:
+            visible &= walls.facing(camera.position)
+        return visible
+
+    def uses_zbuffer(self):
+        return self.zbuffer and self.draw_solid_walls
+
+    def sort_walls(self, visible=None, camera=None, walls=None):
+        if camera is None:
+            camera = self.camera
+        if walls is None:
+            walls = self.partitioned_walls
+        if self.uses_zbuffer():
+            return walls.select(camera.position, visible)
+        if self.hierarchy_order:
+            return walls.figure_order(camera, visible)
+        return walls.depth_order(camera.position, visible)
+
+    def transform_walls(self, order, depths, camera=None, walls=None):
+        if camera is None:
+            camera = self.camera
+        if walls is None:
+            walls = self.partitioned_walls
+        return walls.project(camera, order, depths)
+
+    def fill_walls(self, projected_walls):
+        if not self.draw_walls:
+            return
+
+        if self.uses_zbuffer():
+            self.draw_zbuffer_walls(projected_walls)
+        elif self.color_walls:
+            self.draw_color_walls(projected_walls.screen_walls, self.partitioned_walls.figure_ids[projected_walls.order])
+        else:
+            self.draw_mono_walls(projected_walls.screen_walls, projected_walls.depths)
+
+    def draw_color_walls(self, transformed_walls, figure_ids):
+        for transformed_wall, figure_id in zip(transformed_walls, figure_ids):
+            if self.draw_solid_walls:
+                self.draw_wall(transformed_wall, figure_id)
+            else:
+                self.draw_wall_see_through(transformed_wall, figure_id)
+
+    def draw_mono_walls(self, transformed_walls, depths):
+        for transformed_wall, color in zip(transformed_walls, self.mono_colors(depths).tolist()):
+            if self.draw_solid_walls:
+                self.draw_wall_with_color(transformed_wall, color)
+            else:
+                self.draw_wall_see_through_with_color(transformed_wall, color)
+
+    def mono_colors(self, depths):
+        """(K, 3) uint8 gray of every wall, darker with distance and lighter with light strength."""
+        if self.mono_table_strength != self.light_strength:
+            self.mono_table = mono_shading_table(self.light_strength)
+            self.mono_table_strength = self.light_strength
+
+        buckets = np.minimum(depths // 5, len(self.mono_table) - 1).astype(int)
+        return self.mono_table[buckets]
+
+    def draw_zbuffer_walls(self, projected_walls):
         if self.color_walls:
-            self.draw_color_walls()
+            figure_ids = self.partitioned_walls.figure_ids[projected_walls.order]
+            colors = np.array(Colors.WALLS)[figure_ids % len(Colors.WALLS)]
         else:
-            self.draw_mono_walls()
-
-    def draw_color_walls(self):
-        for figure_id, wall in self.partitioned_walls:
-            transformed_wall = self.transform_points(wall)
-
-            if self.draw_walls:
-                if self.draw_solid_walls:
-                    self.draw_wall(transformed_wall, figure_id)
-                else:
-                    self.draw_wall_see_through(transformed_wall, figure_id)
+            colors = self.mono_colors(projected_walls.depths)
 
-    def draw_mono_walls(self):
-        # Length to the first wall
-        distance = calculate_depth(self.partitioned_walls[-1][1], self.camera_position)
-
-        # Total number of objects to draw
-        total_objects = len(self.partitioned_walls)
-
-        for i, pair in enumerate(self.partitioned_walls):
-            figure_id, wall = pair
-
-            transformed_wall = self.transform_points(wall)
-
-            # Calculate darkness based on distance
-            darkness = min(255, max(0, (255 - (distance // 5) / self.light_strength)))
-
-            if self.draw_walls:
-                if self.draw_solid_walls:
-                    # Draw wall with current darkness
-                    self.draw_wall_with_color(transformed_wall, [darkness, darkness, darkness])
-                else:
-                    # Draw wall see-through with current darkness
-                    self.draw_wall_see_through_with_color(transformed_wall, [darkness, darkness, darkness])
-
-            # Calculate distance for the next object
-            if i < total_objects - 1:
-                next_wall = self.partitioned_walls[i + 1][1]
-                distance = calculate_depth(next_wall, self.camera_position)
-
-    def transform_points(self, points):
-        transformed_points = []
-        for i, point in enumerate(points):
-            transformed_point = transform_point(point, self.camera_position, self.camera_rotation, self.f, self.zoom)
-            transformed_points.append(transformed_point)
-
-        return transformed_points
+        self.zbuffer_renderer.clear(Colors.BLACK)
+        self.zbuffer_renderer.draw_quads(projected_walls.screen_walls, projected_walls.view_depths, colors)
+        self.zbuffer_renderer.present(self.screen)
 
     def draw_wall(self, points, color_id):
-        color = [Colors.RED, Colors.GREEN, Colors.BLUE, Colors.PURPLE][color_id]
+        color = Colors.WALLS[color_id % len(Colors.WALLS)]
         pygame.draw.polygon(self.screen, color, points)
 
     def draw_wall_see_through(self, points, color_id, alpha=50):
-        color = [Colors.RED, Colors.GREEN, Colors.BLUE, Colors.PURPLE][color_id]
-
-        # Create a surface for drawing the transparent wall
-        wall_surface = pygame.Surface((self.screen.get_width(), self.screen.get_height()), pygame.SRCALPHA)
-
-        # Draw the polygon on the surface with the specified color and alpha
-        pygame.draw.polygon(wall_surface, (*color, alpha), points)
-
-        # Blit the transparent surface onto the main screen
-        self.screen.blit(wall_surface, (0, 0))
+        color = Colors.WALLS[color_id % len(Colors.WALLS)]
+        self.draw_wall_see_through_with_color(points, color, alpha)
 
     def draw_wall_with_color(self, points, color):
         pygame.draw.polygon(self.screen, color, points)
 
     def draw_wall_see_through_with_color(self, points, color, alpha=50):
-        # Create a surface for drawing the transparent wall
-        wall_surface = pygame.Surface((self.screen.get_width(), self.screen.get_height()), pygame.SRCALPHA)
-
-        # Draw the polygon on the surface with the specified color and alpha
-        pygame.draw.polygon(wall_surface, (*color, alpha), points)
+        # Draw the polygon on the shared transparent layer
+        rect = pygame.draw.polygon(self.alpha_layer, (*color, alpha), points)
 
-        # Blit the transparent surface onto the main screen
-        self.screen.blit(wall_surface, (0, 0))
+        # Blend only the polygon's bounding rectangle onto the screen, then clear it for the next wall
+        self.screen.blit(self.alpha_layer, rect, rect)
+        self.alpha_layer.fill((0, 0, 0, 0), rect)
 
     def reset_camera(self):
-        self.camera_position = np.array([0.0, 50, 750])
-        self.camera_rotation = np.array([0.0, 0.0, 0.0])
-        self.zoom = 1
+        self.camera = Camera(position=(0.0, 50, 750))
+        self.simulated_camera = self.camera.copy()
+        self.previous_camera = self.camera.copy()
         self.rotation_angle = 0.0001
-        self.f = 1000
         self.speed_up = 75
 
+    def scene_state(self):
+        """Everything the drawn walls depend on; the scene is only redrawn when it changes."""
+        return (self.camera.state(), self.partition_factor, self.draw_walls, self.draw_solid_walls,
+                self.color_walls, self.cull_back_faces, self.zbuffer, self.hierarchy_order, self.light_strength)
+
+    def interpolate_state(self, alpha):
+        """Set the drawn camera and light between the last two simulated steps."""
+        self.camera.interpolate(self.previous_camera, self.simulated_camera, alpha)
+        self.light_strength = (self.previous_light_strength
+                               + (self.simulated_light_strength - self.previous_light_strength) * alpha)
+
+    def at_rest(self):
+        return (self.previous_camera.state() == self.simulated_camera.state()
+                and self.previous_light_strength == self.simulated_light_strength)
+
     def run_simulation(self):
+        table_rects = []
         while True:
-            self.screen.fill(Colors.BLACK)
-            self.handle_input()
-            self.draw_all_walls()
+            steps = self.timestep.advance(self.clock.tick() / 1000)
+            with self.profiler.stage("input"):
+                self.handle_input(steps)
+            self.interpolate_state(self.timestep.alpha)
+
+            scene_state = self.scene_state()
+            # The profiler measures every stage, so it keeps the scene redrawing
+            scene_changed = scene_state != self.drawn_scene_state or self.profiler.enabled
+            if scene_changed:
+                self.screen.fill(Colors.BLACK)
+                self.draw_all_walls()
+                self.scene_surface.blit(self.screen, (0, 0))
+                # A pipelined frame may show the previous camera; keep drawing until it catches up
+                self.drawn_scene_state = scene_state if self.drawn_camera_state == self.camera.state() else None
+            else:
+                # Uncover the scene under the previous table
+                for rect in table_rects:
+                    self.screen.blit(self.scene_surface, rect, rect)
+
+            previous_table_rects = table_rects
+            table_rects = []
             if self.display_table:
-                self.draw_table()
+                with self.profiler.stage("table"):
+                    table_rects = self.draw_table()
 
-            pygame.display.flip()
+            with self.profiler.stage("flip"):
+                if scene_changed:
+                    pygame.display.flip()
+                else:
+                    pygame.display.update(previous_table_rects + table_rects)
 
-            self.clock.tick()
+            self.profiler.end_frame()
 
-    def calculated_fps_slow_down(self):
-        return 75 / self.clock.get_fps() if self.clock.get_fps() != 0 else 1
+            # Held keys keep stepping even in frames where no step falls due
+            if not scene_changed and self.at_rest() and not any(pygame.key.get_pressed()):
+                self.wait_for_event()
 
-    def get_speed_up(self):
-        return self.speed_up * self.calculated_fps_slow_down()
+    def wait_for_event(self):
+        """Sleep until the next event, leaving it queued for handle_input."""
+        pygame.event.post(pygame.event.wait())
+        # Time the next frame from now, so the wait is not simulated
+        self.clock.tick()
 
 
 if __name__ == "__main__":
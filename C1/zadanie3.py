@@ -1,26 +1,40 @@
+import ctypes
+import hashlib
+import os
+
 import pygame
 from pygame.locals import *
 from OpenGL.GL import *
-from OpenGL.GL.shaders import compileProgram, compileShader
 from OpenGL.GLU import *
 import numpy as np
+from hud import TextCache
+from shader import ShaderProgram
+
+SPHERE_CACHE_DIR = "sphere_cache"
+# Bump when create_sphere changes, so stale cached meshes are not reused
+SPHERE_CACHE_VERSION = 2
+# (lat_segments, lon_segments) from the finest to the coarsest level of detail
+SPHERE_LOD_LEVELS = [(100, 1000), (50, 500), (24, 240), (12, 120), (6, 60)]
 
 vertex_shader = """
 #version 330
 in vec3 position;
 in vec3 normal;
+in mat4 instanceModel;
+in int instanceMaterial;
 
 out vec3 FragPos;
 out vec3 Normal;
+flat out int MaterialIndex;
 
-uniform mat4 model;
 uniform mat4 view;
 uniform mat4 projection;
 
 void main()
 {
-    FragPos = vec3(model * vec4(position, 1.0));
-    Normal = mat3(transpose(inverse(model))) * normal;
+    FragPos = vec3(instanceModel * vec4(position, 1.0));
+    Normal = mat3(transpose(inverse(instanceModel))) * normal;
+    MaterialIndex = instanceMaterial;
     gl_Position = projection * view * vec4(FragPos, 1.0);
 }
 """
@@ -29,19 +43,32 @@ fragment_shader = """
 #version 330 core
 in vec3 FragPos;
 in vec3 Normal;
+flat in int MaterialIndex;
 
 out vec4 FragColor;
 
 uniform vec3 lightPos;
 uniform vec3 viewPos;
 uniform vec3 lightColor;
-uniform vec3 ambient;
-uniform vec3 diffuse;
-uniform vec3 specular;
-uniform float shininess;
+
+struct Material {
+    vec3 ambient;
+    vec3 diffuse;
+    vec3 specular;
+    float shininess;
+};
+
+layout(std140) uniform Materials {
+    Material materials[MATERIAL_COUNT];
+};
 
 void main()
 {
+    vec3 ambient = materials[MaterialIndex].ambient;
+    vec3 diffuse = materials[MaterialIndex].diffuse;
+    vec3 specular = materials[MaterialIndex].specular;
+    float shininess = materials[MaterialIndex].shininess;
+
     // Ambient
     float ambientStrength = 0.1;
     vec3 ambientLight = ambientStrength * lightColor * ambient;
@@ -67,52 +94,136 @@ void main()
 
 
 def create_sphere(radius, lat_segments, lon_segments):
-    vertices = []
-    normals = []
-    indices = []
-
-    for i in range(lat_segments + 1):
-        theta = i * np.pi / lat_segments
-        sin_theta = np.sin(theta)
-        cos_theta = np.cos(theta)
-
-        for j in range(lon_segments):
-            phi = j * 2 * np.pi / lon_segments
-            sin_phi = np.sin(phi)
-            cos_phi = np.cos(phi)
-
-            x = cos_phi * sin_theta
-            y = cos_theta
-            z = sin_phi * sin_theta
-
-            vertices.append((radius * x, radius * y, radius * z))
-            normals.append((x, y, z))
-
-    for i in range(lat_segments):
-        for j in range(lon_segments):
-            first = (i * (lon_segments + 1)) + j
-            second = first + lon_segments + 1
-
-            indices.append(first)
-            indices.append(second)
-            indices.append(first + 1)
-
-            indices.append(second)
-            indices.append(second + 1)
-            indices.append(first + 1)
+    theta = np.arange(lat_segments + 1)[:, None] * np.pi / lat_segments
+    phi = np.arange(lon_segments)[None, :] * 2 * np.pi / lon_segments
+
+    x = np.cos(phi) * np.sin(theta)
+    y = np.broadcast_to(np.cos(theta), x.shape)
+    z = np.sin(phi) * np.sin(theta)
+    directions = np.stack([x, y, z], axis=-1).reshape(-1, 3)
+
+    # Each ring has lon_segments vertices, so the last column wraps to the first
+    i = np.arange(lat_segments)[:, None]
+    j = np.arange(lon_segments)[None, :]
+    first = i * lon_segments + j
+    first_next = i * lon_segments + (j + 1) % lon_segments
+    second = first + lon_segments
+    second_next = first_next + lon_segments
+    indices = np.stack(
+        [first, second, first_next, second, second_next, first_next], axis=-1
+    )
 
     return (
-        np.array(vertices, dtype=np.float32),
-        np.array(normals, dtype=np.float32),
-        np.array(indices, dtype=np.uint32),
+        (radius * directions).astype(np.float32),
+        directions.astype(np.float32),
+        indices.reshape(-1).astype(np.uint32),
     )
 
 
+def load_sphere(radius, lat_segments, lon_segments, cache_dir=SPHERE_CACHE_DIR):
+    """create_sphere backed by .npy files, which are memory-mapped when present."""
+    key = repr((SPHERE_CACHE_VERSION, float(radius), int(lat_segments), int(lon_segments)))
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    paths = [
+        os.path.join(cache_dir, f"sphere_{digest}_{name}.npy")
+        for name in ("vertices", "normals", "indices")
+    ]
+
+    try:
+        return tuple(np.load(path, mmap_mode="r") for path in paths)
+    except (OSError, ValueError):
+        pass
+
+    arrays = create_sphere(radius, lat_segments, lon_segments)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for path, array in zip(paths, arrays):
+            # Write aside and rename, so a reader never maps a partial file
+            temporary_path = f"{path}.{os.getpid()}.tmp"
+            with open(temporary_path, "wb") as file:
+                np.save(file, array)
+            os.replace(temporary_path, path)
+    except OSError:
+        pass
+    return arrays
+
+
+class SphereLod:
+    """Sphere meshes of decreasing detail sharing one vertex and one index buffer.
+
+    Every level owns a range of the index buffer, with indices already offset
+    into the shared vertices. select picks the coarsest level whose edges stay
+    under pixels_per_segment on screen, and then only leaves the current level
+    once the projected radius is more than `hysteresis` past its threshold.
+    """
+
+    def __init__(self, radius, levels, pixels_per_segment=2.0, hysteresis=0.15):
+        self.radius = radius
+        self.levels = levels
+        self.pixels_per_segment = pixels_per_segment
+        self.hysteresis = hysteresis
+        self.level = None
+
+        meshes = [load_sphere(radius, lat, lon) for lat, lon in levels]
+        vertex_counts = [len(vertices) for vertices, _, _ in meshes]
+        vertex_offsets = np.cumsum([0] + vertex_counts[:-1])
+        index_counts = [len(indices) for _, _, indices in meshes]
+        index_offsets = np.cumsum([0] + index_counts[:-1])
+
+        self.vertices = np.concatenate([vertices for vertices, _, _ in meshes])
+        self.normals = np.concatenate([normals for _, normals, _ in meshes])
+        self.indices = np.concatenate([
+            indices + np.uint32(offset)
+            for (_, _, indices), offset in zip(meshes, vertex_offsets)
+        ])
+        self.index_ranges = [
+            (int(offset), count) for offset, count in zip(index_offsets, index_counts)
+        ]
+
+    def projected_radius(self, center, view_pos, projection, viewport_height):
+        """Radius of the sphere on screen in pixels, for one center or an (N, 3) array of them."""
+        projection = np.asarray(projection)
+        scale = projection[1, 1] * viewport_height / 2
+        if projection[3, 2] == 0:
+            # Orthographic projection: the size does not depend on distance
+            return self.radius * scale
+
+        distance = np.maximum(np.linalg.norm(np.asarray(center) - view_pos, axis=-1), 1e-6)
+        return self.radius * scale / distance
+
+    def level_for(self, radius):
+        segments_needed = 2 * np.pi * radius / self.pixels_per_segment
+        for level in range(len(self.levels) - 1, -1, -1):
+            if self.levels[level][1] >= segments_needed:
+                return level
+        return 0
+
+    def select(self, radius):
+        if self.level is None:
+            self.level = self.level_for(radius)
+            return self.level
+
+        finest = self.level_for(radius * (1 + self.hysteresis))
+        coarsest = self.level_for(radius * (1 - self.hysteresis))
+        self.level = min(max(self.level, finest), coarsest)
+        return self.level
+
+    def draw(self, instance_count=1):
+        offset, count = self.index_ranges[self.level]
+        glDrawElementsInstanced(
+            GL_TRIANGLES,
+            count,
+            GL_UNSIGNED_INT,
+            ctypes.c_void_p(offset * self.indices.itemsize),
+            instance_count,
+        )
+
+
 def compile_shader_program():
-    shader = compileProgram(
-        compileShader(vertex_shader, GL_VERTEX_SHADER),
-        compileShader(fragment_shader, GL_FRAGMENT_SHADER),
+    shader = ShaderProgram(
+        vertex_shader, fragment_shader.replace("MATERIAL_COUNT", str(len(materials)))
     )
+    shader.bind_uniform_block("Materials", MATERIALS_BINDING)
     return shader
 
 
@@ -142,32 +253,113 @@ materials = {
         8.0,
     ),
 }
+MATERIAL_NAMES = list(materials)
+MATERIALS_BINDING = 0
 current_material = "metal"
 
 
-def change_material(shader, material):
-    ambient, diffuse, specular, shininess = materials[material]
-    glUniform3fv(glGetUniformLocation(shader, "ambient"), 1, ambient)
-    glUniform3fv(glGetUniformLocation(shader, "diffuse"), 1, diffuse)
-    glUniform3fv(glGetUniformLocation(shader, "specular"), 1, specular)
-    glUniform1f(glGetUniformLocation(shader, "shininess"), shininess)
+def material_block():
+    """Pack the materials into the std140 layout of the Materials uniform block."""
+    # ambient, pad, diffuse, pad, specular, shininess: 48 bytes per array element
+    block = np.zeros((len(materials), 12), dtype=np.float32)
+    for i, (ambient, diffuse, specular, shininess) in enumerate(materials.values()):
+        block[i, 0:3] = ambient
+        block[i, 4:7] = diffuse
+        block[i, 8:11] = specular
+        block[i, 11] = shininess
+    return block
+
+
+def create_material_buffer():
+    block = material_block()
+    UBO = glGenBuffers(1)
+    glBindBuffer(GL_UNIFORM_BUFFER, UBO)
+    glBufferData(GL_UNIFORM_BUFFER, block.nbytes, block, GL_STATIC_DRAW)
+    glBindBuffer(GL_UNIFORM_BUFFER, 0)
+    glBindBufferBase(GL_UNIFORM_BUFFER, MATERIALS_BINDING, UBO)
+    return UBO
+
+
+# Model matrices are stored column-major, the layout of mat4 vertex attributes
+INSTANCE_DTYPE = np.dtype([("model", np.float32, (4, 4)), ("material", np.int32)])
+
+
+def sphere_instances(material):
+    """One sphere with the given material, or a row of small spheres for "all"."""
+    if material != "all":
+        instances = np.zeros(1, dtype=INSTANCE_DTYPE)
+        instances["model"] = np.identity(4)
+        instances["material"] = MATERIAL_NAMES.index(material)
+        return instances
+
+    instances = np.zeros(len(MATERIAL_NAMES), dtype=INSTANCE_DTYPE)
+    for i in range(len(MATERIAL_NAMES)):
+        model = np.diag([0.4, 0.4, 0.4, 1.0])
+        model[0, 3] = (i - (len(MATERIAL_NAMES) - 1) / 2) * 0.5
+        instances[i]["model"] = model.T
+        instances[i]["material"] = i
+    return instances
+
+
+def instance_matrices(instances):
+    return np.transpose(instances["model"], (0, 2, 1))
+
+
+def create_instance_buffer(shader):
+    """Per-instance model matrix and material attributes, set up on the bound VAO."""
+    IBO = glGenBuffers(1)
+    glBindBuffer(GL_ARRAY_BUFFER, IBO)
+    stride = INSTANCE_DTYPE.itemsize
+
+    model = shader.attribute_location("instanceModel")
+    for column in range(4):
+        glVertexAttribPointer(
+            model + column,
+            4,
+            GL_FLOAT,
+            GL_FALSE,
+            stride,
+            ctypes.c_void_p(INSTANCE_DTYPE.fields["model"][1] + column * 16),
+        )
+        glVertexAttribDivisor(model + column, 1)
+        glEnableVertexAttribArray(model + column)
+
+    material = shader.attribute_location("instanceMaterial")
+    glVertexAttribIPointer(
+        material, 1, GL_INT, stride, ctypes.c_void_p(INSTANCE_DTYPE.fields["material"][1])
+    )
+    glVertexAttribDivisor(material, 1)
+    glEnableVertexAttribArray(material)
+    return IBO
+
+
+def upload_instances(IBO, instances):
+    glBindBuffer(GL_ARRAY_BUFFER, IBO)
+    glBufferData(GL_ARRAY_BUFFER, instances.nbytes, instances, GL_DYNAMIC_DRAW)
+
+
+def text_pixels(surface):
+    surface = surface.convert_alpha()
+    return surface.get_width(), surface.get_height(), pygame.image.tostring(surface, "RGBA", True)
+
+
+text_cache = None
 
 
 def draw_text(x, y, text):
-    font = pygame.font.SysFont("arial", 28)
-    text_surface = font.render(text, False, (0, 255, 66, 255)).convert_alpha()
-    text_data = pygame.image.tostring(text_surface, "RGBA", True)
+    global text_cache
+    if text_cache is None:
+        font = pygame.font.SysFont("arial", 28)
+        text_cache = TextCache(font, (0, 255, 66, 255), antialias=False, convert=text_pixels)
+
+    width, height, text_data = text_cache.render(text)
     glWindowPos2d(x, y)
-    glDrawPixels(
-        text_surface.get_width(),
-        text_surface.get_height(),
-        GL_RGBA,
-        GL_UNSIGNED_BYTE,
-        text_data,
-    )
+    glDrawPixels(width, height, GL_RGBA, GL_UNSIGNED_BYTE, text_data)
 
 
 def main():
+    global current_material
+
     pygame.init()
     screen = pygame.display.set_mode((800, 600), DOUBLEBUF | OPENGL)
     pygame.display.set_caption("Phong Shading in PyOpenGL")
@@ -179,8 +371,10 @@ def main():
     glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
 
     shader = compile_shader_program()
+    create_material_buffer()
 
-    vertices, normals, indices = create_sphere(0.5, 100, 1000)
+    sphere = SphereLod(0.5, SPHERE_LOD_LEVELS)
+    vertices, normals, indices = sphere.vertices, sphere.normals, sphere.indices
 
     VAO = glGenVertexArrays(1)
     VBO = glGenBuffers(1)
@@ -199,20 +393,25 @@ def main():
     glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
 
     glBindBuffer(GL_ARRAY_BUFFER, VBO)
-    position = glGetAttribLocation(shader, "position")
+    position = shader.attribute_location("position")
     glVertexAttribPointer(position, 3, GL_FLOAT, GL_FALSE, 0, None)
     glEnableVertexAttribArray(position)
 
     glBindBuffer(GL_ARRAY_BUFFER, NBO)
-    normal = glGetAttribLocation(shader, "normal")
+    normal = shader.attribute_location("normal")
     glVertexAttribPointer(normal, 3, GL_FLOAT, GL_FALSE, 0, None)
     glEnableVertexAttribArray(normal)
 
+    IBO = create_instance_buffer(shader)
+    instances = sphere_instances(current_material)
+    instances_material = current_material
+    upload_instances(IBO, instances)
+
     glBindVertexArray(0)
 
+    # The sphere is modelled directly in clip space; view_pos only lights it
     projection = np.matrix(np.identity(4), dtype=np.float32)
     view = np.matrix(np.identity(4), dtype=np.float32)
-    model = np.matrix(np.identity(4), dtype=np.float32)
 
     light_strength = 1.0
     light_pos = np.array([106.00, 100.00, -1200.00], dtype=np.float32)
@@ -225,8 +424,6 @@ def main():
     font = pygame.font.Font(None, 72)
     debug_mode = False
 
-    global current_material
-
     while running:
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -240,9 +437,17 @@ def main():
                     current_material = "wood"
                 elif event.key == K_4:
                     current_material = "wall"
+                elif event.key == K_5:
+                    current_material = "all"
                 elif event.key == K_d:
                     debug_mode = not debug_mode
 
+        # Switching material only rewrites the small instance buffer
+        if current_material != instances_material:
+            instances = sphere_instances(current_material)
+            instances_material = current_material
+            upload_instances(IBO, instances)
+
         keys = pygame.key.get_pressed()
         if keys[K_LEFT]:
             light_pos[0] -= 50.1
@@ -277,27 +482,23 @@ def main():
 
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
-        glUseProgram(shader)
+        shader.use()
 
-        glUniformMatrix4fv(
-            glGetUniformLocation(shader, "projection"), 1, GL_FALSE, projection
-        )
-        glUniformMatrix4fv(glGetUniformLocation(shader, "view"), 1, GL_FALSE, view)
-        glUniformMatrix4fv(glGetUniformLocation(shader, "model"), 1, GL_FALSE, model)
-
-        glUniform3fv(glGetUniformLocation(shader, "lightPos"), 1, light_pos)
-        glUniform3fv(glGetUniformLocation(shader, "viewPos"), 1, view_pos)
-        glUniform3fv(glGetUniformLocation(shader, "lightColor"), 1, light_color)
-        glUniform3fv(
-            glGetUniformLocation(shader, "objectColor"),
-            1,
-            np.array([1.0, 1.0, 1.0], dtype=np.float32),
-        )
+        # Unchanged values are not uploaded again
+        shader.set_uniform("projection", projection)
+        shader.set_uniform("view", view)
+
+        shader.set_uniform("lightPos", light_pos)
+        shader.set_uniform("viewPos", view_pos)
+        shader.set_uniform("lightColor", light_color)
 
-        change_material(shader, current_material)
+        # One level of detail for all instances, picked for the largest on screen
+        models = instance_matrices(instances)
+        radii = sphere.projected_radius(models[:, :3, 3], view_pos, projection, screen.get_height())
+        sphere.select(np.max(radii * np.linalg.norm(models[:, :3, 0], axis=1)))
 
         glBindVertexArray(VAO)
-        glDrawElements(GL_TRIANGLES, len(indices), GL_UNSIGNED_INT, None)
+        sphere.draw(len(instances))
         glBindVertexArray(0)
 
         if debug_mode:
@@ -305,6 +506,7 @@ def main():
             draw_text(10, 80, f"View pos: {view_pos}")
             draw_text(10, 150, f"Light strength: {light_strength}")
             draw_text(10, 220, f"Material: {current_material}")
+            draw_text(10, 290, f"Sphere LOD: {sphere.levels[sphere.level]}")
 
         pygame.display.flip()
         clock.tick(60)